@@ -0,0 +1,177 @@
+"""Storage benchmarks at realistic cohort sizes, runnable offline.
+
+    python bench_storage.py                                    # 1k/10k/100k rows, both backends
+    python bench_storage.py --sizes 1000 10000 --backends sqlite --repeat 500 --output bench.json
+
+For every size a synthetic persistent_user_data.xlsx in the ALL_EXPECTED_HEADERS layout
+is generated (seeded, so runs are comparable) and every backend times the calls main.py
+makes: startup load, UID login, registration with UID allocation, Corsi result upsert,
+the overwrite check, /mydata, and /export (fresh after a write, and served from cache),
+plus UID logins issued while a workbook save or an export is running.
+Results are printed as JSON - one record per backend, size and operation with
+mean/p50/p95/min/max in milliseconds - and optionally written to --output.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+
+from export import ExportBuilder, write_export
+from storage import (
+    ALL_EXPECTED_HEADERS, CORSI_HEADERS, EXCEL_FILENAME, SQLITE_FILENAME, create_results_repository,
+)
+from uid_allocator import MAX_UID, MIN_UID, UidAllocator
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def synthetic_rows(count: int, rng: random.Random):
+    """Participants like the real sheet: everyone has a profile, most did Corsi, some Stroop."""
+    started = datetime.datetime(2025, 1, 1)
+    for unique_id in rng.sample(range(MIN_UID, MAX_UID + 1), count):
+        row = {
+            "Telegram ID": rng.randrange(10 ** 8, 10 ** 10), "Unique ID": unique_id,
+            "Name": f"Participant {unique_id}", "Age": rng.randrange(18, 80),
+            "Last Updated": (started + datetime.timedelta(minutes=rng.randrange(600_000))).isoformat(
+                sep=" ", timespec="seconds"),
+        }
+        if rng.random() < 0.8:
+            length = rng.randrange(2, 10)
+            row.update({
+                "Corsi - Max Correct Sequence Length": length,
+                "Corsi - Avg Time Per Element (s)": round(rng.uniform(0.4, 1.5), 2),
+                "Corsi - Sequence Times Detail": "; ".join(f"L{n}:{rng.uniform(1, 9):.2f}s" for n in range(2, length + 1)),
+                "Corsi - Interrupted": "Нет",
+            })
+        if rng.random() < 0.4:
+            for part in (1, 2, 3):
+                row[f"Stroop Part{part} Time (s)"] = round(rng.uniform(5, 20), 2)
+                row[f"Stroop Part{part} Errors"] = rng.randrange(3)
+            row["Stroop - Interrupted"] = "Нет"
+        yield row
+
+
+def _stats(backend: str, rows: int, operation: str, samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "backend": backend, "rows": rows, "operation": operation, "n": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        "min_ms": round(samples[0] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+async def _timed(samples: list, coro):
+    started = time.perf_counter()
+    result = await coro
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+async def bench_backend(backend: str, directory: str, rows: int, uids: list, repeat: int, rng: random.Random) -> list:
+    def open_repository():
+        return create_results_repository(backend, excel_filename=os.path.join(directory, EXCEL_FILENAME),
+                                         sqlite_filename=os.path.join(directory, SQLITE_FILENAME))
+
+    repository = open_repository()
+    if backend == "sqlite":
+        # The first open imports the workbook; time the steady-state startup instead.
+        await repository.load()
+        await repository.close()
+        repository = open_repository()
+    samples = {}
+
+    def record(operation: str) -> list:
+        return samples.setdefault(operation, [])
+
+    await _timed(record("startup_load"), repository.load())
+    allocator = UidAllocator("bench")
+    await _timed(record("uid_allocator_load"), allocator.load(repository))
+    export_builder = ExportBuilder(repository, directory=os.path.join(directory, "exports"))
+    corsi_values = {header: None for header in CORSI_HEADERS}
+    corsi_values.update({"Corsi - Max Correct Sequence Length": 5, "Corsi - Avg Time Per Element (s)": 0.8,
+                         "Corsi - Interrupted": "Нет"})
+
+    for _ in range(repeat):
+        uid = rng.choice(uids)
+        await _timed(record("uid_login"), repository.find_by_uid(uid))
+        await _timed(record("overwrite_check"), repository.completed_tests(uid))
+        await _timed(record("mydata"), repository.find_by_uid(uid))
+        await _timed(record("corsi_upsert"), repository.update_results(uid, corsi_values, profile={}))
+
+        async def register():
+            unique_id = allocator.allocate()
+            if not await repository.uid_exists(unique_id):
+                await repository.create_profile(rng.randrange(10 ** 8, 10 ** 10), unique_id, "Bench", 30)
+
+        await _timed(record("registration"), register())
+
+    async def login_while(operation: str, background):
+        """Times UID logins issued while `background` (a save or an export) is running."""
+        task = asyncio.ensure_future(background)
+        while not task.done():
+            await _timed(record(operation), repository.find_by_uid(rng.choice(uids)))
+            await asyncio.sleep(0.01)
+        await task
+
+    if backend == "excel":
+        await _timed(record("write_behind_flush"), repository.flush())
+        await repository.update_results(rng.choice(uids), corsi_values, profile={})
+        await login_while("uid_login_during_flush", repository.flush())
+    for _ in range(max(1, repeat // 50)):
+        await repository.update_results(rng.choice(uids), corsi_values, profile={})  # invalidates the snapshot
+        await _timed(record("export_xlsx"), export_builder.build("xlsx", headers=ALL_EXPECTED_HEADERS))
+        await _timed(record("export_xlsx_cached"), export_builder.build("xlsx", headers=ALL_EXPECTED_HEADERS))
+    await repository.update_results(rng.choice(uids), corsi_values, profile={})
+    await login_while("uid_login_during_export", export_builder.build("xlsx", headers=ALL_EXPECTED_HEADERS))
+    await repository.close()
+    return [_stats(backend, rows, operation, values) for operation, values in samples.items()]
+
+
+async def run(sizes: list, backends: list, repeat: int, seed: int) -> dict:
+    results = []
+    for rows in sizes:
+        for backend in backends:
+            rng = random.Random(seed)
+            with tempfile.TemporaryDirectory(prefix="bench_storage_") as directory:
+                started = time.perf_counter()
+                sheet = list(synthetic_rows(rows, rng))
+                write_export(os.path.join(directory, EXCEL_FILENAME), "xlsx", ALL_EXPECTED_HEADERS, sheet)
+                print(f"{backend}: generated {rows} rows in {time.perf_counter() - started:.1f}s", flush=True)
+                uids = [row["Unique ID"] for row in sheet]
+                del sheet
+                results.extend(await bench_backend(backend, directory, rows, uids, repeat, rng))
+    return {
+        "meta": {
+            "python": platform.python_version(), "platform": platform.platform(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"), "seed": seed, "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the results storage at realistic cohort sizes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--backends", nargs="+", choices=("excel", "sqlite"), default=["excel", "sqlite"])
+    parser.add_argument("--repeat", type=int, default=200, help="samples per per-request operation")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    report = asyncio.run(run(args.sizes, args.backends, args.repeat, args.seed))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
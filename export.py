@@ -0,0 +1,94 @@
+import asyncio
+import csv
+import gzip
+import hashlib
+import logging
+import os
+
+from openpyxl import Workbook
+
+from storage import ResultsRepository
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIRECTORY = "exports"
+EXPORT_FORMATS = ("xlsx", "csv", "csv.gz")
+
+
+def _write_xlsx(path: str, headers: list, rows):
+    # write_only streams rows straight to the zip: memory stays flat however large the cohort is.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(headers)
+    for row_values in rows:
+        ws.append([row_values.get(header) for header in headers])
+    wb.save(path)
+
+
+def _write_csv(path: str, headers: list, rows, compress: bool):
+    opener = gzip.open if compress else open
+    # utf-8-sig so Excel opens the Cyrillic names correctly.
+    with opener(path, "wt", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for row_values in rows:
+            writer.writerow(["" if row_values.get(header) is None else row_values.get(header) for header in headers])
+
+
+def write_export(path: str, fmt: str, headers: list, rows):
+    tmp_path = f"{path}.tmp"
+    if fmt == "xlsx":
+        _write_xlsx(tmp_path, headers, rows)
+    else:
+        _write_csv(tmp_path, headers, rows, compress=fmt == "csv.gz")
+    os.replace(tmp_path, path)
+
+
+class ExportBuilder:
+    """Builds /export snapshots from a results repository and reuses them until the next write."""
+
+    def __init__(self, repository: ResultsRepository, directory: str = EXPORT_DIRECTORY):
+        self.repository = repository
+        self.directory = directory
+        self._cache = {}  # export key -> (repository version, path)
+        self._lock = asyncio.Lock()
+
+    async def build(self, fmt: str = "xlsx", headers: list = None, required_headers: list = None,
+                    date_from: str = None, date_to: str = None) -> str:
+        """Returns the path of a snapshot in `fmt` with the `headers` columns.
+
+        Only rows with a value in at least one of `required_headers` (when given) and a
+        "Last Updated" date within [date_from, date_to] (ISO dates, inclusive) are kept.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt!r}")
+        headers = list(headers)
+        key = (fmt, tuple(headers), tuple(required_headers or ()), date_from, date_to)
+
+        async with self._lock:
+            version = await self.repository.snapshot_version()
+            cached = self._cache.get(key)
+            if cached and cached[0] == version and os.path.exists(cached[1]):
+                logger.info("Serving cached export %s (version %s).", cached[1], version)
+                return cached[1]
+
+            os.makedirs(self.directory, exist_ok=True)
+            digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:12]
+            path = os.path.join(self.directory, f"export_{digest}.{fmt}")
+
+            def row_filter(row_values: dict) -> bool:
+                if required_headers and all(row_values.get(h) is None for h in required_headers):
+                    return False
+                updated = str(row_values.get("Last Updated") or "")[:10]
+                if date_from and (not updated or updated < date_from):
+                    return False
+                if date_to and (not updated or updated > date_to):
+                    return False
+                return True
+
+            # Only the copy is taken on the storage thread; queries need not wait for the file.
+            rows = await self.repository.dump_all()
+            await asyncio.to_thread(write_export, path, fmt, headers, filter(row_filter, rows))
+            self._cache[key] = (version, path)
+            logger.info("Built export %s (format %s, version %s).", path, fmt, version)
+            return path
@@ -0,0 +1,271 @@
+"""Fake Telegram Bot API server for load-testing the bot offline.
+
+Point the bot at it with TELEGRAM_API_BASE = "http://127.0.0.1:8081" in config.py (and
+RUN_MODE = "polling"). It answers the methods the bot uses with plausible objects, hands
+out updates queued with `send_text()` / `press_button()` through getUpdates, reports
+every call to the chat's subscribers and counts flood-limit violations. See
+load_simulator.py for the virtual users that drive it.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Calls that Telegram throttles per chat and globally.
+FLOOD_COUNTED_METHODS = {"sendMessage", "sendDocument", "editMessageText", "editMessageReplyMarkup"}
+TEXT_FIELDS = {"text", "caption"}  # never JSON-decoded, "30" stays a string
+
+
+class ApiError(Exception):
+    def __init__(self, code: int, description: str, retry_after: int | None = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+
+class ApiCall:
+    """One Bot API request as seen by the server; `at` is its arrival (monotonic seconds)."""
+
+    def __init__(self, method: str, chat_id, params: dict, result, at: float):
+        self.method = method
+        self.chat_id = chat_id
+        self.params = params
+        self.result = result
+        self.at = at
+
+    @property
+    def text(self) -> str:
+        return self.params.get("text") or ""
+
+    @property
+    def markup_texts(self) -> list:
+        rows = (self.params.get("reply_markup") or {}).get("inline_keyboard") or []
+        return [button.get("text") for row in rows for button in row]
+
+
+class FakeTelegramServer:
+    """In-memory stand-in for api.telegram.org, private chats only.
+
+    Flood limits approximate Telegram's: more than `chat_limit` throttled calls within
+    any second in one chat, or more than `global_limit` within any second overall,
+    counts as a violation. With `enforce_limits` such calls also get a 429 with
+    retry_after, as Telegram would answer them.
+    """
+
+    def __init__(self, chat_limit: int = 5, global_limit: int = 30, enforce_limits: bool = False):
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.enforce_limits = enforce_limits
+        self.method_counts = Counter()
+        self.flood_violations = Counter()  # "chat" / "global"
+        self.rejected_429 = 0
+        self.delivered_at = {}  # update_id -> when getUpdates handed it to the bot
+        self.polling = asyncio.Event()  # set by the bot's first getUpdates
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._callback_chats = {}  # callback_query id -> chat id, for answerCallbackQuery
+        self._messages = {}  # (chat_id, message_id) -> message object
+        self._subscribers = defaultdict(list)  # chat id -> [asyncio.Queue of ApiCall]
+        self._chat_windows = defaultdict(deque)
+        self._global_window = deque()
+        self._bot_user = {"id": 1, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    # --- Updates from virtual users ---
+    def subscribe(self, chat_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers[chat_id].append(queue)
+        return queue
+
+    def unsubscribe(self, chat_id: int, queue: asyncio.Queue):
+        self._subscribers[chat_id].remove(queue)
+        if not self._subscribers[chat_id]:
+            del self._subscribers[chat_id]
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}"}
+
+    def _push(self, update: dict) -> int:
+        update_id = update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_updates.set()
+        return update_id
+
+    def send_text(self, user_id: int, text: str) -> int:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._push({"message": message})
+
+    def press_button(self, user_id: int, data: str, message_id: int) -> int:
+        message = self._messages.get((user_id, message_id)) or {
+            "message_id": message_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+            "from": self._bot_user, "text": "",
+        }
+        callback_id = str(next(self._callback_ids))
+        self._callback_chats[callback_id] = user_id
+        return self._push({"callback_query": {
+            "id": callback_id, "from": self._user(user_id), "chat_instance": str(user_id), "data": data,
+            "message": message,
+        }})
+
+    # --- Request handling ---
+    async def _read_params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params, files = {}, {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, web.FileField):
+                files[key] = {"file_name": value.filename, "size": len(value.file.read())}
+            elif key in TEXT_FIELDS:
+                params[key] = value
+            else:
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+        # Uploads arrive as a separate part, referenced from the parameter as "attach://<part name>".
+        for key, value in params.items():
+            if isinstance(value, str) and value.startswith("attach://"):
+                params[key] = files.get(value[len("attach://"):], {})
+        return params
+
+    def _check_flood(self, chat_id, now: float):
+        windows = [("global", self._global_window, self.global_limit)]
+        if chat_id is not None:
+            windows.append(("chat", self._chat_windows[chat_id], self.chat_limit))
+        exceeded = False
+        for kind, window, limit in windows:
+            while window and now - window[0] >= 1.0:
+                window.popleft()
+            if len(window) >= limit:
+                self.flood_violations[kind] += 1
+                exceeded = True
+        if exceeded and self.enforce_limits:
+            self.rejected_429 += 1
+            raise ApiError(429, "Too Many Requests: retry after 1", retry_after=1)
+        for _, window, _ in windows:
+            window.append(now)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        now = time.monotonic()
+        params = await self._read_params(request)
+        chat_id = params.get("chat_id")
+        if chat_id is None and "callback_query_id" in params:
+            chat_id = self._callback_chats.pop(str(params["callback_query_id"]), None)
+        self.method_counts[method] += 1
+        try:
+            if method in FLOOD_COUNTED_METHODS:
+                self._check_flood(chat_id, now)
+            if method == "getUpdates":
+                result = await self._get_updates(params)
+            else:
+                handler = getattr(self, f"_api_{method}", None)
+                result = handler(params) if handler else True
+        except ApiError as e:
+            body = {"ok": False, "error_code": e.code, "description": e.description}
+            if e.retry_after:
+                body["parameters"] = {"retry_after": e.retry_after}
+            return web.json_response(body, status=e.code)
+        call = ApiCall(method, chat_id, params, result, now)
+        for queue in self._subscribers.get(chat_id, ()):
+            queue.put_nowait(call)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> list:
+        self.polling.set()
+        offset = params.get("offset")
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and params.get("timeout"):
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=params["timeout"])
+            except asyncio.TimeoutError:
+                pass
+        batch = self._updates[:params.get("limit") or 100]
+        now = time.monotonic()
+        for update in batch:
+            self.delivered_at.setdefault(update["update_id"], now)
+        return batch
+
+    # --- Methods ---
+    def _api_getMe(self, params: dict) -> dict:
+        return dict(self._bot_user, can_join_groups=False, can_read_all_group_messages=False,
+                    supports_inline_queries=False)
+
+    def _new_message(self, params: dict, **content) -> dict:
+        chat_id = params["chat_id"]
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._bot_user,
+            **content,
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        self._messages[chat_id, message["message_id"]] = message
+        return message
+
+    def _api_sendMessage(self, params: dict) -> dict:
+        return self._new_message(params, text=params.get("text", ""))
+
+    def _api_sendDocument(self, params: dict) -> dict:
+        document = params.get("document") or {}
+        return self._new_message(params, caption=params.get("caption", ""), document={
+            "file_id": f"file{next(self._message_ids)}", "file_unique_id": "u", "file_name": document.get("file_name"),
+            "file_size": document.get("size"),
+        })
+
+    def _edit(self, params: dict, **content) -> dict:
+        message = self._messages.get((params.get("chat_id"), params.get("message_id")))
+        if message is None:
+            raise ApiError(400, "Bad Request: message to edit not found")
+        markup = params.get("reply_markup")
+        if all(message.get(key) == value for key, value in content.items()) and message.get("reply_markup") == markup:
+            raise ApiError(400, "Bad Request: message is not modified: specified new message content and reply "
+                                "markup are exactly the same as a current content and reply markup of the message")
+        message.update(content, edit_date=int(time.time()))
+        if markup:
+            message["reply_markup"] = markup
+        else:
+            message.pop("reply_markup", None)
+        return message
+
+    def _api_editMessageText(self, params: dict) -> dict:
+        return self._edit(params, text=params.get("text", ""))
+
+    def _api_editMessageReplyMarkup(self, params: dict) -> dict:
+        return self._edit(params)
+
+    def _api_deleteMessage(self, params: dict) -> bool:
+        if self._messages.pop((params.get("chat_id"), params.get("message_id")), None) is None:
+            raise ApiError(400, "Bad Request: message to delete not found")
+        return True
+
+    def _api_deleteMessages(self, params: dict) -> bool:
+        for message_id in params.get("message_ids") or []:
+            self._messages.pop((params.get("chat_id"), message_id), None)
+        return True
@@ -0,0 +1,300 @@
+import asyncio
+import functools
+import json
+import logging
+import sqlite3
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from aiogram import Dispatcher
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+FSM_SQLITE_FILENAME = "fsm_state.sqlite3"
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in a local SQLite file, so active profiles and running tests survive restarts.
+
+    Sessions that have not been written to for `state_ttl` seconds are treated as
+    empty and purged every `purge_interval` seconds, which keeps the table bounded
+    by the number of recently active users rather than everyone who ever used the bot.
+    """
+
+    def __init__(self, filename: str = FSM_SQLITE_FILENAME, state_ttl: float | None = 7 * 24 * 3600,
+                 purge_interval: float = 3600, key_builder: KeyBuilder | None = None):
+        self.filename = filename
+        self.state_ttl = state_ttl
+        self.purge_interval = purge_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._conn = None
+        self._loop = None
+        self._purge_task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-storage")
+
+    async def _run(self, func, *args):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            await self._loop.run_in_executor(self._executor, self._open)
+            if self.state_ttl:
+                self._purge_task = asyncio.create_task(self._purge_loop())
+        return await self._loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.filename)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_updated_at ON fsm (updated_at)")
+
+    def _expired_before(self) -> float:
+        return time.time() - self.state_ttl if self.state_ttl else 0
+
+    def _read(self, key: str) -> tuple[str | None, dict]:
+        row = self._conn.execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND updated_at >= ?", (key, self._expired_before())
+        ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _write_state(self, key: str, state: str | None):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (key, state, time.time()),
+            )
+
+    def _write_data(self, key: str, data: str):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (key, data, time.time()),
+            )
+
+    def _write_record(self, key: str, state: str | None, data: str):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+                (key, state, data, time.time()),
+            )
+
+    def _purge(self) -> int:
+        with self._conn:
+            return self._conn.execute("DELETE FROM fsm WHERE updated_at < ?", (self._expired_before(),)).rowcount
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                purged = await self._run(self._purge)
+                if purged:
+                    logger.info("Evicted %s idle FSM sessions from '%s'.", purged, self.filename)
+            except Exception as e:
+                logger.error("Error evicting idle FSM sessions: %s", e)
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state_str = state.state if isinstance(state, State) else state
+        await self._run(self._write_state, self.key_builder.build(key), state_str)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._run(self._read, self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        await self._run(self._write_data, self.key_builder.build(key), json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._run(self._read, self.key_builder.build(key))
+        return data
+
+    async def get_record(self, key: StorageKey) -> tuple[str | None, dict[str, Any]]:
+        """Reads state and data together in one query (used by FSMSnapshot)."""
+        return await self._run(self._read, self.key_builder.build(key))
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Mapping[str, Any]) -> None:
+        """Writes state and data together in one statement (used by FSMSnapshot.flush)."""
+        state_str = state.state if isinstance(state, State) else state
+        await self._run(self._write_record, self.key_builder.build(key), state_str,
+                        json.dumps(data, ensure_ascii=False))
+
+    async def close(self) -> None:
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            self._purge_task = None
+        if self._conn is not None:
+            await self._loop.run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+class FSMSnapshot(FSMContext):
+    """FSMContext that reads the storage at most once per update and writes back once.
+
+    The first read (aiogram's own state lookup) loads state and data together when
+    the storage has `get_record`; otherwise data is loaded lazily on first use. All
+    mutations stay local until `flush()`, which SnapshotFSMContextMiddleware calls
+    when the update has been handled. Long-running handlers can `flush()` early to
+    publish their state to concurrent updates, and must `discard()` pending changes
+    when another update has taken over the session. `on_published` is called once,
+    after the first flush.
+    """
+
+    def __init__(self, storage: BaseStorage, key: StorageKey, on_published: Callable[[], Any] | None = None):
+        super().__init__(storage, key)
+        self._state = None
+        self._data = None
+        self._state_loaded = False
+        self._state_dirty = False
+        self._data_dirty = False
+        self._on_published = on_published
+
+    async def _load_state(self) -> str | None:
+        if not self._state_loaded:
+            if hasattr(self.storage, "get_record"):
+                state, data = await self.storage.get_record(self.key)
+                if self._data is None:
+                    self._data = data
+            else:
+                state = await self.storage.get_state(key=self.key)
+            self._state = state
+            self._state_loaded = True
+        return self._state
+
+    async def _load_data(self) -> dict[str, Any]:
+        if self._data is None:
+            self._data = await self.storage.get_data(key=self.key)
+        return self._data
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._state = state.state if isinstance(state, State) else state
+        self._state_loaded = True
+        self._state_dirty = True
+
+    async def get_state(self) -> str | None:
+        return await self._load_state()
+
+    async def set_data(self, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        self._data = data.copy()
+        self._data_dirty = True
+
+    async def get_data(self) -> dict[str, Any]:
+        return (await self._load_data()).copy()
+
+    async def get_value(self, key: str, default: Any | None = None) -> Any | None:
+        return (await self._load_data()).get(key, default)
+
+    async def update_data(self, data: Mapping[str, Any] | None = None, **kwargs: Any) -> dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        current_data = await self._load_data()
+        current_data.update(kwargs)
+        self._data_dirty = True
+        return current_data.copy()
+
+    async def flush(self) -> None:
+        if self._state_dirty and self._data_dirty and hasattr(self.storage, "set_record"):
+            await self.storage.set_record(self.key, self._state, self._data)
+        else:
+            if self._state_dirty:
+                await self.storage.set_state(key=self.key, state=self._state)
+            if self._data_dirty:
+                await self.storage.set_data(key=self.key, data=self._data)
+        self._state_dirty = self._data_dirty = False
+        self.published()
+
+    def published(self) -> None:
+        if self._on_published is not None:
+            on_published, self._on_published = self._on_published, None
+            on_published()
+
+    def discard(self) -> None:
+        self._state_dirty = self._data_dirty = False
+
+
+class SnapshotFSMContextMiddleware(FSMContextMiddleware):
+    """aiogram's FSM middleware, handing each update an FSMSnapshot and writing it back after the handler.
+
+    Replaces `Dispatcher.fsm` (see `install`), so the state aiogram reads for filtering
+    is the snapshot's one storage read rather than a separate round trip before it.
+    Reading everything up front means an update must not start before the previous
+    update of the same session has written its snapshot back: updates of one session
+    wait for each other until the running handler flushes (early, or when it is done).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._turns = {}  # storage key -> [lock, updates holding or waiting for it]
+
+    @classmethod
+    def install(cls, dispatcher: Dispatcher) -> "SnapshotFSMContextMiddleware":
+        """Swaps the dispatcher's FSM middleware for this one; build the dispatcher with disable_fsm=True."""
+        fsm = cls(storage=dispatcher.fsm.storage, events_isolation=dispatcher.fsm.events_isolation,
+                  strategy=dispatcher.fsm.strategy)
+        dispatcher.fsm = fsm
+        dispatcher.update.outer_middleware(fsm)
+        return fsm
+
+    async def __call__(
+            self,
+            handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+            event: Any,
+            data: dict[str, Any],
+    ) -> Any:
+        context = self.resolve_event_context(data["bot"], data)
+        data["fsm_storage"] = self.storage
+        if context is None:
+            return await handler(event, data)
+        turn = self._turns.setdefault(context.key, [asyncio.Lock(), 0])
+        turn[1] += 1
+        try:
+            async with self.events_isolation.lock(key=context.key):
+                await turn[0].acquire()
+                snapshot = FSMSnapshot(context.storage, context.key, on_published=turn[0].release)
+                try:
+                    data.update({"state": snapshot, "raw_state": await snapshot.get_state()})
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        await snapshot.flush()
+                finally:
+                    snapshot.published()
+        finally:
+            turn[1] -= 1
+            if not turn[1]:
+                del self._turns[context.key]
+
+
+def create_fsm_storage(backend: str = "sqlite", **options) -> BaseStorage:
+    state_ttl = options.get("state_ttl", 7 * 24 * 3600)
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(options.get("sqlite_filename", FSM_SQLITE_FILENAME), state_ttl=state_ttl)
+    if backend == "redis":
+        # Optional dependency (pip install redis); any server speaking the Redis protocol will do.
+        from aiogram.fsm.storage.redis import RedisStorage
+        ttl = int(state_ttl) if state_ttl else None
+        return RedisStorage.from_url(options.get("redis_url", "redis://localhost:6379/0"), state_ttl=ttl, data_ttl=ttl)
+    raise ValueError(f"Unknown FSM storage backend: {backend!r}")
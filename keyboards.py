@@ -0,0 +1,105 @@
+import json
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiohttp import FormData
+
+from stroop import STROOP_COLORS
+
+IKB = InlineKeyboardButton
+
+CORSI_CELL_TEXT = "🟪"
+CORSI_CELL_HIGHLIGHTED_TEXT = "🟨"
+CORSI_RESTART_BUTTON = IKB(text="🔄", callback_data="corsi_stop_this_attempt")
+
+# id(markup) -> (markup, JSON payload). The markup is kept alongside so its id is never reused.
+_prepared_payloads = {}
+
+
+def prepare_markup(markup: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    """Serializes `markup` once; PreparedMarkupSession sends the stored payload from then on.
+
+    Only for markups that live for the whole process (module-level keyboards).
+    """
+    if id(markup) not in _prepared_payloads:
+        payload = json.dumps(markup.model_dump(warnings=False, exclude_none=True))
+        _prepared_payloads[id(markup)] = (markup, payload)
+    return markup
+
+
+def prepared_payload(markup) -> str | None:
+    entry = _prepared_payloads.get(id(markup))
+    return entry[1] if entry is not None and entry[0] is markup else None
+
+
+class PreparedMarkupSession(AiohttpSession):
+    """AiohttpSession that skips re-serializing reply markups registered with `prepare_markup`."""
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        payload = prepared_payload(getattr(method, "reply_markup", None))
+        if payload is None:
+            return super().build_form_data(bot, method)
+        form = FormData(quote_fields=False)
+        files = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", payload)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
+
+
+# --- Corsi grid ---
+# A grid is identified by the bitmask of highlighted cells: 0 is the plain grid, 1 << i the
+# flash of cell i, and any other mask a partially entered answer. Flashes and the plain grid
+# are built up front; answer grids are built the first time a mask is needed (at most 2^9).
+_corsi_grids = {}
+
+
+def corsi_grid_markup(highlighted_mask: int = 0) -> InlineKeyboardMarkup:
+    markup = _corsi_grids.get(highlighted_mask)
+    if markup is None:
+        rows = [
+            [IKB(text=CORSI_CELL_HIGHLIGHTED_TEXT if highlighted_mask >> (r * 3 + c) & 1 else CORSI_CELL_TEXT,
+                 callback_data=f"corsi_button_{r * 3 + c}") for c in range(3)]
+            for r in range(3)]
+        rows.append([CORSI_RESTART_BUTTON])
+        markup = _corsi_grids[highlighted_mask] = prepare_markup(InlineKeyboardMarkup(inline_keyboard=rows))
+    return markup
+
+
+def corsi_input_mask(cell_indices) -> int:
+    mask = 0
+    for index in cell_indices:
+        mask |= 1 << index
+    return mask
+
+
+CORSI_BASE_MARKUP = corsi_grid_markup(0)
+CORSI_FLASH_MARKUPS = tuple(corsi_grid_markup(1 << i) for i in range(9))
+
+
+# --- Stroop ---
+STROOP_STOP_BUTTON = IKB(text="⏹ Прервать", callback_data="stroop_stop_test")
+STROOP_START_MARKUP = prepare_markup(InlineKeyboardMarkup(inline_keyboard=[
+    [IKB(text="Начать", callback_data="stroop_start_part")],
+    [STROOP_STOP_BUTTON],
+]))
+# The trial index is part of the callback data, so a late second tap on a stimulus that is
+# already gone is recognised and ignored. One markup per index, built on first use.
+_stroop_answer_markups = {}
+
+
+def stroop_answer_markup(trial: int) -> InlineKeyboardMarkup:
+    markup = _stroop_answer_markups.get(trial)
+    if markup is None:
+        buttons = [IKB(text=name, callback_data=f"stroop_answer_{trial}_{color}")
+                   for color, (name, _, _) in enumerate(STROOP_COLORS)]
+        rows = [buttons[:3], buttons[3:], [STROOP_STOP_BUTTON]]
+        markup = _stroop_answer_markups[trial] = prepare_markup(InlineKeyboardMarkup(inline_keyboard=rows))
+    return markup
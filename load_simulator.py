@@ -0,0 +1,194 @@
+"""Drives virtual participants through the bot against the fake Bot API server.
+
+    # config.py: TELEGRAM_API_BASE = "http://127.0.0.1:8081", RUN_MODE = "polling"
+    python load_simulator.py --users 100     # starts the fake API server and waits for the bot
+    python main.py                           # in a second terminal
+
+Every user registers (/start, name, age), takes the Corsi test - repeating the first
+`--correct-trials` sequences correctly and then answering wrong until the test ends -
+and asks for /mydata and /export. The JSON report has per-step p50/p95/p99 latency
+(from the moment the bot fetched the update to the reply the user was waiting for), API
+calls per Corsi test, calls per method and the flood-limit violations the server saw.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+from fake_telegram import ApiCall, FakeTelegramServer
+from keyboards import CORSI_CELL_HIGHLIGHTED_TEXT
+
+
+class StepTimeout(Exception):
+    pass
+
+
+class VirtualUser:
+    def __init__(self, server: FakeTelegramServer, user_id: int, latencies: dict, timeout: float):
+        self.server = server
+        self.user_id = user_id
+        self.latencies = latencies
+        self.timeout = timeout
+        self.calls = server.subscribe(user_id)
+        self.call_count = 0
+
+    async def _wait_for(self, step: str | None, update_id: int | None, expected) -> ApiCall:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                call = await asyncio.wait_for(self.calls.get(), timeout=max(remaining, 0))
+            except asyncio.TimeoutError:
+                raise StepTimeout(step or "corsi_display")
+            self.call_count += 1
+            if expected(call):
+                if step is not None:
+                    delivered_at = self.server.delivered_at.get(update_id, call.at)
+                    self.latencies.setdefault(step, []).append(call.at - delivered_at)
+                return call
+
+    async def send_text(self, step: str, text: str, expected) -> ApiCall:
+        return await self._wait_for(step, self.server.send_text(self.user_id, text), expected)
+
+    async def press(self, step: str, data: str, message_id: int, expected) -> ApiCall:
+        return await self._wait_for(step, self.server.press_button(self.user_id, data, message_id), expected)
+
+    async def watch(self, expected) -> ApiCall:
+        """Waits for a call the user did not trigger directly (the Corsi display)."""
+        return await self._wait_for(None, None, expected)
+
+    def close(self):
+        self.server.unsubscribe(self.user_id, self.calls)
+
+
+def _sent(text_prefix: str):
+    return lambda call: call.method == "sendMessage" and call.text.startswith(text_prefix)
+
+
+def _edited(text_prefix: str):
+    return lambda call: call.method == "editMessageText" and call.text.startswith(text_prefix)
+
+
+async def run_corsi(user: VirtualUser, menu_message_id: int, correct_trials: int) -> int:
+    """Takes the Corsi test from the main menu; returns the API calls the test cost."""
+    calls_before = user.call_count
+    await user.press("select_test_menu", "select_specific_test", menu_message_id, _edited("Выберите тест"))
+    grid = await user.press("start_corsi", "select_test_initiate_corsi_test", menu_message_id, _sent("Тест Корси"))
+    grid_message_id = grid.result["message_id"]
+    trial = 0
+    while True:
+        sequence = []
+        while True:
+            call = await user.watch(lambda c: c.method in ("editMessageReplyMarkup", "editMessageText", "sendMessage"))
+            if call.text.startswith("Повторите последовательность"):
+                break
+            if call.method == "editMessageReplyMarkup" and call.params.get("message_id") == grid_message_id:
+                highlighted = [i for i, text in enumerate(call.markup_texts) if text == CORSI_CELL_HIGHLIGHTED_TEXT]
+                sequence.extend(highlighted)
+        answer = sequence if trial < correct_trials else sequence[::-1]  # sequences have distinct cells
+        for i, cell in enumerate(answer):
+            last_tap = i == len(answer) - 1
+            # An unchanged "Ошибка!" feedback edit is never sent; the final summary answers then.
+            expected = (lambda c: "Верно" in c.text or "Ошибка" in c.text or c.text.startswith("Тест Корси <b>")
+                        ) if last_tap else (lambda c: c.method == "editMessageReplyMarkup")
+            await user.press("corsi_tap", f"corsi_button_{cell}", grid_message_id, expected)
+        trial += 1
+        # Two wrong answers in a row end the test; the menu comes back afterwards.
+        if trial >= correct_trials + 2:
+            await user.watch(_sent("Выберите дальнейшее действие"))
+            return user.call_count - calls_before
+
+
+async def run_user(user: VirtualUser, correct_trials: int, results: dict):
+    try:
+        welcome = await user.send_text("start", "/start", _sent("Вы впервые"))
+        await user.press("user_is_new", "user_is_new", welcome.result["message_id"], _sent("Привет!"))
+        await user.send_text("name", f"Load{user.user_id}", _sent("Отлично!"))
+        menu = await user.send_text("age_registration", "30", _sent("Выберите дальнейшее действие"))
+        results["api_calls_per_corsi_test"].append(await run_corsi(user, menu.result["message_id"], correct_trials))
+        await user.send_text("mydata", "/mydata", _sent("Данные для активного профиля"))
+        await user.send_text("export", "/export", lambda c: c.method == "sendDocument")
+        results["completed"] += 1
+    except StepTimeout as e:
+        results["timeouts"][str(e)] = results["timeouts"].get(str(e), 0) + 1
+    finally:
+        user.close()
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run(users: int, host: str, port: int, first_user_id: int, correct_trials: int, ramp: float,
+              timeout: float, chat_limit: int, global_limit: int, enforce_limits: bool) -> dict:
+    server = FakeTelegramServer(chat_limit=chat_limit, global_limit=global_limit, enforce_limits=enforce_limits)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Fake Bot API listening on http://{host}:{port}; waiting for the bot to poll...", flush=True)
+    try:
+        await server.polling.wait()
+        latencies = {}
+        results = {"completed": 0, "timeouts": {}, "api_calls_per_corsi_test": []}
+        started = time.perf_counter()
+
+        async def start_user(index: int):
+            await asyncio.sleep(ramp * index / users)
+            user = VirtualUser(server, first_user_id + index, latencies, timeout)
+            await run_user(user, correct_trials, results)
+
+        await asyncio.gather(*(start_user(i) for i in range(users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+
+    steps = {}
+    for step, values in latencies.items():
+        values.sort()
+        steps[step] = {
+            "count": len(values),
+            "p50_ms": round(_percentile(values, 0.5) * 1000, 1),
+            "p95_ms": round(_percentile(values, 0.95) * 1000, 1),
+            "p99_ms": round(_percentile(values, 0.99) * 1000, 1),
+        }
+    per_test = results["api_calls_per_corsi_test"]
+    return {
+        "users": users,
+        "completed": results["completed"],
+        "timeouts": results["timeouts"],
+        "elapsed_s": round(elapsed, 2),
+        "steps": steps,
+        "api_calls_per_corsi_test": {
+            "avg": round(sum(per_test) / len(per_test), 1) if per_test else None,
+            "max": max(per_test, default=None),
+        },
+        "api_calls_by_method": dict(server.method_counts.most_common()),
+        "flood_violations": dict(server.flood_violations),
+        "rejected_429": server.rejected_429,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the bot with virtual users against a fake Bot API.")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--first-user-id", type=int, default=10_000_000)
+    parser.add_argument("--correct-trials", type=int, default=2, help="Corsi sequences answered correctly")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which the users join")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-step wait for the bot's reply")
+    parser.add_argument("--chat-limit", type=int, default=5, help="throttled calls per chat per second")
+    parser.add_argument("--global-limit", type=int, default=30, help="throttled calls per second overall")
+    parser.add_argument("--enforce-limits", action="store_true", help="answer flood violations with 429")
+    args = parser.parse_args()
+    report = asyncio.run(run(args.users, args.host, args.port, args.first_user_id, args.correct_trials, args.ramp,
+                             args.timeout, args.chat_limit, args.global_limit, args.enforce_limits))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from aiogram import BaseMiddleware
+
+LOG_FORMATS = ("json", "text")
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+CONTEXT_FIELDS = ("user", "uid", "test")
+# Arguments of these types cannot change before the listener thread formats the record.
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None), bytes)
+
+# Fields of the update being handled. Tasks started by a handler (timed steps, saves) inherit the
+# same dict, so whatever bind_log_context() adds later in the update is seen by them too.
+_log_context = contextvars.ContextVar("log_context", default=None)
+
+
+def bind_log_context(**fields):
+    """Adds fields (uid=..., test=...) to every record logged for the current update."""
+    context = _log_context.get()
+    if context is None:
+        _log_context.set(fields)
+    else:
+        context.update(fields)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Outer update middleware: starts a fresh log context with the user and the running test.
+
+    `test_groups` maps a StatesGroup name to the test name reported for users in one of its states.
+    """
+
+    def __init__(self, test_groups: dict | None = None):
+        self.test_groups = test_groups or {}
+
+    async def __call__(
+            self,
+            handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+            event: Any,
+            data: dict[str, Any],
+    ) -> Any:
+        context = {}
+        user = data.get("event_from_user")
+        if user is not None:
+            context["user"] = user.id
+        raw_state = data.get("raw_state")
+        if raw_state:
+            test = self.test_groups.get(raw_state.split(":", 1)[0])
+            if test:
+                context["test"] = test
+        token = _log_context.set(context)
+        try:
+            return await handler(event, data)
+        finally:
+            _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the update's log context onto the record; runs where the record is logged, not on the listener."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        if context:
+            for field, value in context.items():
+                if not hasattr(record, field):
+                    setattr(record, field, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one in `sample_every` records logged with extra={"sample_every": N}, per message.
+
+    For events that fire many times a second in busy sessions (each Corsi flash, each tap);
+    the kept record carries `sampled=N` so totals can still be estimated.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._seen = {}  # (logger name, message template) -> records seen
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample_every", None)
+        if not every or every <= 1:
+            return True
+        key = (record.name, record.msg)
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        if seen % every:
+            return False
+        record.sampled = every
+        return True
+
+
+class DeferredFormattingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves %-formatting to the listener thread.
+
+    The stock handler formats every record before queueing it. Here only records whose
+    arguments are mutable (dicts, lists, FSM data that may change before the listener gets
+    to them) are formatted on the way in; everything else is formatted off the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args and not all(isinstance(arg, _IMMUTABLE_ARGS) for arg in (
+                record.args.values() if isinstance(record.args, dict) else record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, context fields, exception."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS + ("sampled",):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str | int = logging.INFO, log_format: str = "json") -> logging.handlers.QueueListener:
+    """Routes all logging through a queue to a listener thread that formats and writes to stderr.
+
+    Handlers only append records to the queue; the listener is stopped (and the queue
+    drained) at interpreter exit.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format: {log_format!r}")
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredFormattingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
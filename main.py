@@ -1,15 +1,13 @@
 import asyncio
+import functools
 import logging
 import random
-import os
 import time
 import config  # Assuming this file contains BOT_TOKEN
-from openpyxl import Workbook, load_workbook
-from openpyxl.utils.exceptions import InvalidFileException
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import (
     Message,
     CallbackQuery,
@@ -17,39 +15,98 @@ from aiogram.types import (
     InlineKeyboardButton,
     FSInputFile,
 )
-from aiogram.filters import Command, CommandStart, StateFilter
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
+from export import EXPORT_FORMATS, ExportBuilder
+from fsm_storage import FSM_SQLITE_FILENAME, SnapshotFSMContextMiddleware, create_fsm_storage
+from log_setup import LogContextMiddleware, bind_log_context, setup_logging
+from metrics import ApiMetricsMiddleware, BotMetrics, HandlerMetricsMiddleware, MetricsExporter
+from keyboards import (
+    CORSI_BASE_MARKUP, CORSI_FLASH_MARKUPS, STROOP_START_MARKUP, PreparedMarkupSession, corsi_grid_markup,
+    corsi_input_mask, stroop_answer_markup,
+)
+from outbound import PRIORITY_BULK, PRIORITY_TIMING, EditDeduplicator, OutboundScheduler, outbound_priority
+from run_registry import TestRunRegistry
+from uid_allocator import UidAllocator
+from stroop import (
+    STROOP_PART_INTROS, STROOP_PARTS, generate_stroop_deck, stroop_ink, stroop_part_time, stroop_trial_text,
+)
+from sending import concurrently, in_order
+from storage import (
+    ALL_EXPECTED_HEADERS, BASE_HEADERS, CORSI_HEADERS, EXCEL_FILENAME, META_HEADERS, RESULT_BITS, SQLITE_FILENAME,
+    STROOP_HEADERS, create_results_repository,
+)
+from timing import (
+    ReceiptTimestampMiddleware, RoundTripMiddleware, TimedPlan, TimingScheduler, corsi_latency_report,
+    corsi_tap_times_detail, corsi_trial_timing, ns_to_ms,
+)
+from webhook import WEBHOOK_PATH, run_webhook
+from workers import ShardRouter
 
 # --- Globals & Constants ---
+TELEGRAM_API_BASE = getattr(config, "TELEGRAM_API_BASE", None)  # e.g. the fake server of load_simulator.py
 bot = Bot(
-    config.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    config.BOT_TOKEN,
+    session=PreparedMarkupSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE) if TELEGRAM_API_BASE else PRODUCTION),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
 )
-dp = Dispatcher(storage=MemoryStorage())
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+OUTBOUND_GLOBAL_RATE = getattr(config, "OUTBOUND_GLOBAL_RATE", 29.0)  # + a burst of 1: at most 30 calls a second
+outbound_scheduler = OutboundScheduler(
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    chat_rate=getattr(config, "OUTBOUND_CHAT_RATE", 4.0),
+    chat_burst=getattr(config, "OUTBOUND_CHAT_BURST", 1.0),
+    priority_aging=getattr(config, "OUTBOUND_PRIORITY_AGING", 1.0),  # seconds of waiting per lane moved up
+)
+bot.session.middleware(EditDeduplicator())  # outermost: no-op edits never wait for a rate-limit token
+bot.session.middleware(outbound_scheduler)
+bot_metrics = BotMetrics()
+bot.session.middleware(ApiMetricsMiddleware(bot_metrics))  # times the HTTP round trip alone
+bot.session.middleware(RoundTripMiddleware())  # innermost: timed steps' lead comes from the round trip alone
+metrics_exporter = MetricsExporter(
+    bot_metrics,
+    host=getattr(config, "METRICS_HOST", "127.0.0.1"),
+    port=getattr(config, "METRICS_PORT", None),  # None: no /metrics endpoint, log summary only
+    log_interval=getattr(config, "METRICS_LOG_INTERVAL", 300),  # 0 disables the periodic summary
 )
+FSM_STORAGE = getattr(config, "FSM_STORAGE", "sqlite")  # "sqlite", "redis" or "memory"
+dp = Dispatcher(storage=create_fsm_storage(
+    FSM_STORAGE,
+    sqlite_filename=getattr(config, "FSM_SQLITE_FILENAME", FSM_SQLITE_FILENAME),
+    redis_url=getattr(config, "FSM_REDIS_URL", "redis://localhost:6379/0"),
+    state_ttl=getattr(config, "FSM_STATE_TTL", 7 * 24 * 3600),
+), disable_fsm=True)
+# Stamped before the FSM middleware, so FSM storage reads and queueing do not count toward reaction times.
+dp.update.outer_middleware(ReceiptTimestampMiddleware())
+SnapshotFSMContextMiddleware.install(dp)  # one FSM read per update, one write after it
+log_context_middleware = LogContextMiddleware()
+dp.update.outer_middleware(log_context_middleware)
+dp.message.middleware(HandlerMetricsMiddleware(bot_metrics))
+dp.callback_query.middleware(HandlerMetricsMiddleware(bot_metrics))
+
+# Records are formatted and written on a listener thread; LOG_FORMAT "json" adds user/uid/test fields.
+setup_logging(getattr(config, "LOG_LEVEL", "INFO"), getattr(config, "LOG_FORMAT", "json"))
 logger = logging.getLogger(__name__)
 
-EXCEL_FILENAME = "persistent_user_data.xlsx"
-
-BASE_HEADERS = ["Telegram ID", "Unique ID", "Name", "Age"]
-CORSI_HEADERS = [
-    "Corsi - Max Correct Sequence Length",
-    "Corsi - Avg Time Per Element (s)",
-    "Corsi - Sequence Times Detail",
-    "Corsi - Interrupted",
-]
-STROOP_HEADERS = [
-    "Stroop Part1 Time (s)", "Stroop Part1 Errors",
-    "Stroop Part2 Time (s)", "Stroop Part2 Errors",
-    "Stroop Part3 Time (s)", "Stroop Part3 Errors",
-    "Stroop - Interrupted",
-]
-ALL_EXPECTED_HEADERS = BASE_HEADERS + CORSI_HEADERS + STROOP_HEADERS
+STORAGE_BACKEND = getattr(config, "STORAGE_BACKEND", "excel")  # "excel" or "sqlite"
+RUN_MODE = getattr(config, "RUN_MODE", "polling")  # "polling" or "webhook"
+WORKER_PROCESSES = getattr(config, "WORKER_PROCESSES", 1)  # >1: updates are sharded by chat across processes
+
+results_store = create_results_repository(
+    STORAGE_BACKEND,
+    excel_filename=EXCEL_FILENAME,
+    sqlite_filename=getattr(config, "SQLITE_FILENAME", SQLITE_FILENAME),
+    flush_interval=getattr(config, "RESULTS_FLUSH_INTERVAL", 5.0),
+    flush_batch_size=getattr(config, "RESULTS_FLUSH_BATCH_SIZE", 25),
+)
+results_store.operation_observer = bot_metrics.observe_storage
+export_builder = ExportBuilder(results_store)
+# The key fixes the (random-looking) UID order; it defaults to the bot token so each deployment gets its own.
+uid_allocator = UidAllocator(str(getattr(config, "UID_PERMUTATION_KEY", config.BOT_TOKEN)))
+# FSM key -> the user's running test. Test code works on its own per-update FSM snapshot and cannot see
+# another update stopping it, so stop/restart/logout cancel the run (and its timed plan) here instead.
+test_runs = TestRunRegistry()
 
 IKB = InlineKeyboardButton
 
@@ -93,38 +150,10 @@ class StroopTestStates(StatesGroup):
 
 
 # --- Helper Functions ---
-def initialize_excel_file():
-    if not os.path.exists(EXCEL_FILENAME):
-        wb = Workbook()
-        ws = wb.active
-        ws.append(ALL_EXPECTED_HEADERS)
-        wb.save(EXCEL_FILENAME)
-        logger.info(f"'{EXCEL_FILENAME}' created with all headers.")
-    else:
-        try:
-            wb = load_workbook(EXCEL_FILENAME)
-            ws = wb.active
-            if ws.max_row == 0:
-                ws.append(ALL_EXPECTED_HEADERS)
-                logger.info(f"Appended all headers to empty sheet in '{EXCEL_FILENAME}'.")
-            else:
-                current_headers = [cell.value for cell in ws[1]]
-                new_headers_to_add = [h for h in ALL_EXPECTED_HEADERS if h not in current_headers]
-                if new_headers_to_add:
-                    header_col_start_index = len(current_headers) + 1
-                    for i, header in enumerate(new_headers_to_add):
-                        ws.cell(row=1, column=header_col_start_index + i).value = header
-                    logger.info(f"Added missing headers to '{EXCEL_FILENAME}': {new_headers_to_add}")
-            wb.save(EXCEL_FILENAME)
-            logger.info(f"'{EXCEL_FILENAME}' checked/updated for headers.")
-        except (InvalidFileException, Exception) as e:
-            logger.error(
-                f"Error initializing/updating Excel file '{EXCEL_FILENAME}': {e}. Manual check might be needed.")
-
-
 async def get_active_profile_from_fsm(state: FSMContext) -> dict | None:
     data = await state.get_data()
     if data.get("active_unique_id"):
+        bind_log_context(uid=data.get("active_unique_id"))
         return {
             "unique_id": data.get("active_unique_id"),
             "name": data.get("active_name"),
@@ -141,74 +170,97 @@ async def send_main_action_menu(
         state: FSMContext = None
 ):
     chat_id = None
+    old_message = None
     if isinstance(trigger_event_or_message, Message):
         chat_id = trigger_event_or_message.chat.id
     elif isinstance(trigger_event_or_message, CallbackQuery):
-        chat_id = trigger_event_or_message.message.chat.id
+        old_message = trigger_event_or_message.message
+        chat_id = old_message.chat.id
+
+    async def remove_old_keyboard():
         try:
-            await trigger_event_or_message.message.edit_reply_markup(reply_markup=None)
+            await old_message.edit_reply_markup(reply_markup=None)
         except TelegramBadRequest:
             pass
 
-    if chat_id:
+    async def send_menu():
         try:
-            await bot.send_message(chat_id, text, reply_markup=keyboard_markup)
+            with outbound_priority(PRIORITY_BULK):
+                await bot.send_message(chat_id, text, reply_markup=keyboard_markup)
         except Exception as e:
-            logger.error(f"Error in send_main_action_menu for chat {chat_id}: {e}")
+            logger.error("Error in send_main_action_menu for chat %s: %s", chat_id, e)
+
+    # The old keyboard and the new menu are separate messages: neither call waits for the other.
+    await concurrently(remove_old_keyboard() if old_message else None, send_menu() if chat_id else None)
+
+
+async def delete_chat_messages(bot_instance: Bot, chat_id: int, message_ids: list):
+    """Deletes the messages with one deleteMessages call; ids that are already gone are skipped."""
+    if not message_ids:
+        return
+    try:
+        if len(message_ids) == 1:
+            await bot_instance.delete_message(chat_id=chat_id, message_id=message_ids[0])
+        else:
+            await bot_instance.delete_messages(chat_id=chat_id, message_ids=message_ids)
+        logger.info("Deleted messages %s in chat %s", message_ids, chat_id)
+    except TelegramBadRequest:
+        logger.warning("Failed to delete messages %s in chat %s (likely already deleted).", message_ids, chat_id)
 
 
 # --- Corsi Test Specific Logic ---
+corsi_timer = TimingScheduler()
+
+CORSI_STATUS_INTERVAL = 1.0  # countdown step
+CORSI_PRE_FLASH_PAUSE = 0.5  # after "Запоминайте..."
+CORSI_FLASH_DURATION = 0.5
+CORSI_FLASH_GAP = 0.2
+CORSI_TAP_LOG_SAMPLE_EVERY = getattr(config, "CORSI_TAP_LOG_SAMPLE_EVERY", 20)  # one tap log in N
+
+
 async def cleanup_corsi_messages(state: FSMContext, bot_instance: Bot, final_text: str = None):
+    test_runs.cancel(state.key)  # already gone when stopped by the user; ends the run on normal completion
     data = await state.get_data()
     chat_id = data.get('corsi_chat_id')
     if not chat_id:
         logger.warning("No 'corsi_chat_id' in FSM for Corsi cleanup, or it was already cleared.")
         return
 
-    msg_ids_to_delete = []
-    if data.get('corsi_status_message_id'):
-        msg_ids_to_delete.append(data.get('corsi_status_message_id'))
-    if data.get('corsi_feedback_message_id'):
-        msg_ids_to_delete.append(data.get('corsi_feedback_message_id'))
+    msg_ids_to_delete = [msg_id for msg_id in (data.get('corsi_status_message_id'),
+                                               data.get('corsi_feedback_message_id')) if msg_id]
 
-    for msg_id in msg_ids_to_delete:
-        if msg_id:
-            try:
-                await bot_instance.delete_message(chat_id=chat_id, message_id=msg_id)
-                logger.info(f"Deleted Corsi message {msg_id} in chat {chat_id}")
-            except TelegramBadRequest:
-                logger.warning(f"Failed to delete Corsi message {msg_id} in chat {chat_id} (likely already deleted).")
-                pass
-
-    grid_message_id = data.get('corsi_grid_message_id')
-    if grid_message_id:
+    async def close_grid(grid_message_id: int):
         try:
             text_to_set = final_text if final_text else "Тест Корси завершен или отменен."
             await bot_instance.edit_message_text(
                 text=text_to_set, chat_id=chat_id, message_id=grid_message_id, reply_markup=None
             )
-            logger.info(f"Edited Corsi grid message {grid_message_id} in chat {chat_id}")
+            logger.info("Edited Corsi grid message %s in chat %s", grid_message_id, chat_id)
         except TelegramBadRequest:
             logger.warning(
-                f"Failed to edit Corsi grid message {grid_message_id} in chat {chat_id} (likely already deleted or no change).")
-            pass
+                "Failed to edit Corsi grid message %s in chat %s (likely already deleted).", grid_message_id, chat_id)
+
+    # The deletions and the grid edit are independent: one round trip instead of three.
+    grid_message_id = data.get('corsi_grid_message_id')
+    await concurrently(delete_chat_messages(bot_instance, chat_id, msg_ids_to_delete),
+                       close_grid(grid_message_id) if grid_message_id else None)
 
     corsi_operational_keys_for_fsm_cleanup = [
         'corsi_chat_id', 'corsi_status_message_id', 'corsi_feedback_message_id', 'corsi_grid_message_id',
         'current_sequence_length', 'error_count', 'sequence_times', 'correct_sequence',
-        'user_input_sequence', 'sequence_start_time'
+        'user_input_sequence', 'sequence_start_time', 'sequence_prompt_sent_ns', 'sequence_start_ns',
+        'sequence_prompt_telegram_date', 'user_input_received_ns', 'user_input_queue_ms'
     ]
-    current_fsm_data = await state.get_data()
-    data_after_corsi_message_cleanup = {k: v for k, v in current_fsm_data.items() if
+    data_after_corsi_message_cleanup = {k: v for k, v in data.items() if
                                         k not in corsi_operational_keys_for_fsm_cleanup}
     await state.set_data(data_after_corsi_message_cleanup)
-    logger.info(f"Cleared Corsi operational FSM keys for chat {chat_id}")
+    logger.info("Cleared Corsi operational FSM keys for chat %s", chat_id)
 
 
 async def show_corsi_sequence(trigger_message: Message, state: FSMContext):
     data = await state.get_data()
     if await state.get_state() != CorsiTestStates.showing_sequence.state:  # Crucial state check
-        logger.info(f"show_corsi_sequence called but state is {await state.get_state()}. Aborting.")
+        logger.info("show_corsi_sequence called but state is %s. Aborting.", await state.get_state())
         return
 
     current_sequence_length = data.get('current_sequence_length', 2)
@@ -221,17 +273,13 @@ async def show_corsi_sequence(trigger_message: Message, state: FSMContext):
 
     grid_message_id_from_state = data.get('corsi_grid_message_id')
 
-    restart_button_row = [IKB(text="🔄", callback_data="corsi_stop_this_attempt")]
     button_indices = list(range(9))
     random.shuffle(button_indices)
     correct_sequence = button_indices[:current_sequence_length]
-    await state.update_data(correct_sequence=correct_sequence, user_input_sequence=[])
+    await state.update_data(correct_sequence=correct_sequence, user_input_sequence=[], user_input_received_ns=[],
+                            user_input_queue_ms=[])
 
-    base_buttons = [IKB(text="🟪", callback_data=f"corsi_button_{i}") for i in range(9)]
-    base_keyboard_grid_rows = [base_buttons[i:i + 3] for i in range(0, 9, 3)]
-    keyboard_for_base_markup_with_restart = [row[:] for row in base_keyboard_grid_rows]
-    keyboard_for_base_markup_with_restart.append(restart_button_row)
-    base_markup_with_restart = InlineKeyboardMarkup(inline_keyboard=keyboard_for_base_markup_with_restart)
+    base_markup_with_restart = CORSI_BASE_MARKUP
 
     if grid_message_id_from_state:
         try:
@@ -250,91 +298,98 @@ async def show_corsi_sequence(trigger_message: Message, state: FSMContext):
     corsi_status_message_id = data.get('corsi_status_message_id')
     status_text_queue = ["Приготовьтесь..."] + [f"{i}..." for i in range(3, 0, -1)] + ["Запоминайте..."]
 
-    for i, text in enumerate(status_text_queue):
-        if await state.get_state() != CorsiTestStates.showing_sequence.state:
-            logger.info(f"Corsi state changed during status message display ({text}); aborting loop.")
-            return
-
-        if not corsi_status_message_id:
-            try:
-                status_obj = await bot.send_message(corsi_chat_id, text)
-                corsi_status_message_id = status_obj.message_id
-                await state.update_data(corsi_status_message_id=corsi_status_message_id)
-            except Exception as e:
-                logger.error(f"Error sending initial Corsi status message: {e}")
-                return
-        else:
-            try:
-                await bot.edit_message_text(text=text, chat_id=corsi_chat_id, message_id=corsi_status_message_id)
-            except TelegramBadRequest:
-                logger.warning(
-                    f"Corsi status message {corsi_status_message_id} not found for edit ({text}), breaking loop.")
-                return
-            except Exception as e:
-                logger.error(f"Error editing Corsi status message ({text}): {e}")
-                return
-
-        if i < len(status_text_queue) - 1:
-            await asyncio.sleep(1)
-        else:
-            await asyncio.sleep(0.5)
-
-    if await state.get_state() != CorsiTestStates.showing_sequence.state:
-        logger.info("Corsi state changed before flashing sequence; aborting.")
-        return
-
-    for button_index in correct_sequence:
-        if await state.get_state() != CorsiTestStates.showing_sequence.state:
-            logger.info(f"Corsi state changed during flash sequence; aborting loop.")
-            return
-
-        flashed_rows = [
-            [IKB(text="🟨" if r * 3 + c == button_index else "🟪", callback_data=f"corsi_button_{r * 3 + c}") for c in
-             range(3)] for r in range(3)]
-        flashed_rows.append(list(restart_button_row))
-        flashed_markup = InlineKeyboardMarkup(inline_keyboard=flashed_rows)
+    if corsi_status_message_id:
         try:
-            await bot.edit_message_reply_markup(chat_id=corsi_chat_id, message_id=grid_message_id_from_state,
-                                                reply_markup=flashed_markup)
-            await asyncio.sleep(0.5)
-            await bot.edit_message_reply_markup(chat_id=corsi_chat_id, message_id=grid_message_id_from_state,
-                                                reply_markup=base_markup_with_restart)
-            await asyncio.sleep(0.2)
+            await bot.edit_message_text(text=status_text_queue[0], chat_id=corsi_chat_id,
+                                        message_id=corsi_status_message_id)
         except TelegramBadRequest:
-            logger.warning(f"Corsi grid message {grid_message_id_from_state} not found for flash edit, breaking loop.")
+            logger.warning("Corsi status message %s not found for edit, aborting display.", corsi_status_message_id)
+            return
+        except Exception as e:
+            logger.error("Error editing Corsi status message (%s): %s", status_text_queue[0], e)
             return
+    else:
+        try:
+            status_obj = await bot.send_message(corsi_chat_id, status_text_queue[0])
+            corsi_status_message_id = status_obj.message_id
+            await state.update_data(corsi_status_message_id=corsi_status_message_id)
         except Exception as e:
-            logger.error(f"Error during Corsi flash sequence: {e}")
+            logger.error("Error sending initial Corsi status message: %s", e)
             return
 
-    if await state.get_state() != CorsiTestStates.showing_sequence.state:
-        logger.info("Corsi state changed before prompting user input; aborting.")
+    run = test_runs.get(state.key)
+    if not test_runs.is_active(state.key, run):
+        state.discard()
+        logger.info("Corsi display cancelled before the countdown; aborting.")
         return
+    # Publish the state and message IDs now so the stop button and /stoptest work during the display.
+    await state.flush()
+
+    async def show_status(text: str):
+        await bot.edit_message_text(text=text, chat_id=corsi_chat_id, message_id=corsi_status_message_id)
 
+    async def show_grid(markup: InlineKeyboardMarkup):
+        with outbound_priority(PRIORITY_TIMING):
+            await bot.edit_message_reply_markup(chat_id=corsi_chat_id, message_id=grid_message_id_from_state,
+                                                reply_markup=markup)
+
+    # Every step is planned against the plan start, so a slow edit delays only itself, never what follows.
+    plan = corsi_timer.plan(f"Corsi display for chat {corsi_chat_id}")
+    run.run_plan(plan)
+    for i, text in enumerate(status_text_queue[1:], start=1):
+        plan.at(i * CORSI_STATUS_INTERVAL, functools.partial(show_status, text))
+    flash_start = (len(status_text_queue) - 1) * CORSI_STATUS_INTERVAL + CORSI_PRE_FLASH_PAUSE
+    for k, button_index in enumerate(correct_sequence):
+        flash_on = flash_start + k * (CORSI_FLASH_DURATION + CORSI_FLASH_GAP)
+        plan.at(flash_on, functools.partial(show_grid, CORSI_FLASH_MARKUPS[button_index]))
+        plan.at(flash_on + CORSI_FLASH_DURATION, functools.partial(show_grid, base_markup_with_restart))
+    plan.at(flash_start + len(correct_sequence) * (CORSI_FLASH_DURATION + CORSI_FLASH_GAP),
+            functools.partial(prompt_for_corsi_sequence, state, plan, corsi_chat_id), compensate=False)
+
+
+async def prompt_for_corsi_sequence(state: FSMContext, plan: TimedPlan, corsi_chat_id: int):
+    """Last step of the display plan: asks for the answer and starts waiting for taps."""
+
+    prompt_telegram_date = None
     try:
         current_data_for_final_prompt = await state.get_data()
         status_msg_id_for_final_prompt = current_data_for_final_prompt.get('corsi_status_message_id')
+        prompt_sent_ns = time.monotonic_ns()
         if status_msg_id_for_final_prompt:
-            await bot.edit_message_text(text="Повторите последовательность:", chat_id=corsi_chat_id,
-                                        message_id=status_msg_id_for_final_prompt)
+            prompt_obj = await bot.edit_message_text(text="Повторите последовательность:", chat_id=corsi_chat_id,
+                                                     message_id=status_msg_id_for_final_prompt)
+            if isinstance(prompt_obj, Message) and prompt_obj.edit_date:
+                prompt_telegram_date = prompt_obj.edit_date  # unix time; unlike `date` it is not parsed
         else:
             logger.warning("Corsi status message ID was None before final prompt. Re-sending prompt message.")
             status_obj = await bot.send_message(corsi_chat_id, "Повторите последовательность:")
+            prompt_telegram_date = int(status_obj.date.timestamp())
             await state.update_data(corsi_status_message_id=status_obj.message_id)
+        # The prompt is on screen from the moment Telegram confirms the edit: reaction time starts here.
+        prompt_shown_ns = time.monotonic_ns()
 
 
     except TelegramBadRequest:
         logger.warning("Corsi status message not found for final prompt 'Повторите последовательность:'.")
         return
     except Exception as e:
-        logger.error(f"Error editing Corsi status message for final prompt: {e}")
+        logger.error("Error editing Corsi status message for final prompt: %s", e)
+        return
+
+    if plan.cancelled:
+        state.discard()
+        logger.info("Corsi display cancelled while prompting user input; aborting.")
         return
 
-    await state.update_data(sequence_start_time=time.time())
+    await state.update_data(sequence_start_time=time.time(), sequence_prompt_sent_ns=prompt_sent_ns,
+                            sequence_start_ns=prompt_shown_ns, sequence_prompt_telegram_date=prompt_telegram_date)
     await state.set_state(CorsiTestStates.waiting_for_user_sequence)
+    await state.flush()
 
 
-async def handle_corsi_button_press(callback: CallbackQuery, state: FSMContext):
+async def handle_corsi_button_press(callback: CallbackQuery, state: FSMContext, received_ns: int = None):
+    handled_ns = time.monotonic_ns()
+    received_ns = received_ns or handled_ns
     if await state.get_state() != CorsiTestStates.waiting_for_user_sequence.state:
         await callback.answer("Тест был прерван или завершен.", show_alert=True)
         logger.warning("handle_corsi_button_press called but state is not waiting_for_user_sequence.")
@@ -343,7 +398,10 @@ async def handle_corsi_button_press(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     button_index = int(callback.data.split("_")[-1])
     data = await state.get_data()
+    bind_log_context(uid=data.get('unique_id_for_test'))
     user_input_sequence = data.get('user_input_sequence', []) + [button_index]
+    user_input_received_ns = data.get('user_input_received_ns', []) + [received_ns]
+    user_input_queue_ms = data.get('user_input_queue_ms', []) + [round((handled_ns - received_ns) / 1_000_000)]
 
     corsi_grid_message_id = data.get('corsi_grid_message_id')
     corsi_chat_id = data.get('corsi_chat_id')
@@ -354,20 +412,19 @@ async def handle_corsi_button_press(callback: CallbackQuery, state: FSMContext):
         await state.clear()
         return
 
-    new_rows = [
-        [IKB(text="🟨" if r * 3 + c in user_input_sequence else "🟪", callback_data=f"corsi_button_{r * 3 + c}") for c in
-         range(3)] for r in range(3)]
-    new_rows.append([IKB(text="🔄", callback_data="corsi_stop_this_attempt")])
     try:
         await bot.edit_message_reply_markup(
             chat_id=corsi_chat_id, message_id=corsi_grid_message_id,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=new_rows)
+            reply_markup=corsi_grid_markup(corsi_input_mask(user_input_sequence))
         )
     except TelegramBadRequest as e:
-        logger.error(f"Error editing markup on Corsi button press: {e}")
+        logger.error("Error editing markup on Corsi button press: %s", e)
         return
 
-    await state.update_data(user_input_sequence=user_input_sequence)
+    await state.update_data(user_input_sequence=user_input_sequence, user_input_received_ns=user_input_received_ns,
+                            user_input_queue_ms=user_input_queue_ms)
+    logger.info("Corsi tap %s of %s, queued %s ms", len(user_input_sequence), len(data.get('correct_sequence', [])),
+                user_input_queue_ms[-1], extra={"sample_every": CORSI_TAP_LOG_SAMPLE_EVERY})
     if await state.get_state() == CorsiTestStates.waiting_for_user_sequence.state:
         if len(user_input_sequence) == len(data.get('correct_sequence', [])):
             await evaluate_user_sequence(callback.message, state)
@@ -382,6 +439,7 @@ async def evaluate_user_sequence(message_context: Message, state: FSMContext):
     if await state.get_state() != CorsiTestStates.waiting_for_user_sequence.state:
         logger.warning("evaluate_user_sequence called but state is not waiting_for_user_sequence.")
         return
+    test_runs.resume(state.key, "corsi")
 
     data = await state.get_data()
     chat_id = data.get('corsi_chat_id', message_context.chat.id)
@@ -392,13 +450,22 @@ async def evaluate_user_sequence(message_context: Message, state: FSMContext):
     seq_times = data.get('sequence_times', [])
     start_time = data.get('sequence_start_time', 0)
     fb_id = data.get('corsi_feedback_message_id')
-    time_taken = time.time() - start_time
+    wall_clock_time_taken = time.time() - start_time
+    tap_received_ns = data.get('user_input_received_ns', [])
+    start_ns = data.get('sequence_start_ns')
+    if start_ns and tap_received_ns and tap_received_ns[0] >= start_ns:
+        trial = corsi_trial_timing(curr_len, data.get('sequence_prompt_sent_ns') or start_ns, start_ns,
+                                   tap_received_ns, data.get('user_input_queue_ms', []), wall_clock_time_taken,
+                                   data.get('sequence_prompt_telegram_date'))
+    else:
+        # No monotonic stamps from this process (e.g. the bot restarted mid-trial): fall back to wall clock.
+        trial = {'len': curr_len, 'time': wall_clock_time_taken}
 
     feedback_message_text = ""
     test_continues = True
 
     if user_seq == correct_seq:
-        seq_times.append({'len': curr_len, 'time': time_taken})
+        seq_times.append(trial)
         curr_len += 1
         err_count = 0
         feedback_message_text = "<b>Верно!</b>"
@@ -422,7 +489,7 @@ async def evaluate_user_sequence(message_context: Message, state: FSMContext):
             fb_id = fb_msg_obj.message_id
             await state.update_data(corsi_feedback_message_id=fb_id)
         except Exception as e:
-            logger.error(f"Error sending feedback message in evaluate_user_sequence: {e}")
+            logger.error("Error sending feedback message in evaluate_user_sequence: %s", e)
             pass
 
     if user_seq == correct_seq and test_continues and fb_id:
@@ -432,9 +499,10 @@ async def evaluate_user_sequence(message_context: Message, state: FSMContext):
         except TelegramBadRequest:
             pass
 
-    if await state.get_state() != CorsiTestStates.waiting_for_user_sequence.state:
+    if not test_runs.is_active(state.key):
+        state.discard()
         logger.info(
-            "State changed during evaluate_user_sequence before deciding next step. Aborting further action here.")
+            "Corsi test cancelled during evaluate_user_sequence before deciding next step. Aborting further action here.")
         return
 
     if test_continues:
@@ -445,31 +513,19 @@ async def evaluate_user_sequence(message_context: Message, state: FSMContext):
         )
         await show_corsi_sequence(message_context, state)
     else:
-        await save_corsi_results(message_context, state, is_interrupted=False)
-        await cleanup_corsi_messages(state, bot, final_text="Тест Корси завершен.")
-
-        fsm_data_after_test_cleanup = await state.get_data()
-        main_profile_data_to_keep = {}
-        if "active_unique_id" in fsm_data_after_test_cleanup:
-            main_profile_data_to_keep["active_unique_id"] = fsm_data_after_test_cleanup.get("active_unique_id")
-            main_profile_data_to_keep["active_name"] = fsm_data_after_test_cleanup.get("active_name")
-            main_profile_data_to_keep["active_age"] = fsm_data_after_test_cleanup.get("active_age")
-            main_profile_data_to_keep["active_telegram_id"] = fsm_data_after_test_cleanup.get("active_telegram_id")
-
-        await state.set_state(None)
-        if main_profile_data_to_keep.get("active_unique_id"):
-            await state.set_data(main_profile_data_to_keep)
-            await send_main_action_menu(message_context, ACTION_SELECTION_KEYBOARD_RETURNING, state=state)
-        else:
-            await message_context.answer("Тест завершен, но ваш профиль не активен. Пожалуйста, используйте /start.")
-            await state.clear()
+        await complete_test(
+            message_context, state, TEST_REGISTRY["initiate_corsi_test"], is_interrupted=False,
+            final_text="Тест Корси завершен.",
+            no_profile_text="Тест завершен, но ваш профиль не активен. Пожалуйста, используйте /start.")
 
 
 async def start_corsi_test(trigger_event_or_message: [Message, CallbackQuery], state: FSMContext, profile_data: dict):
-    logger.info(f"Starting Corsi Test for UID: {profile_data.get('unique_id')}")
+    bind_log_context(uid=profile_data.get('unique_id'), test="corsi")
+    logger.info("Starting Corsi Test for UID: %s", profile_data.get('unique_id'))
 
     message_context = trigger_event_or_message.message if isinstance(trigger_event_or_message,
                                                                      CallbackQuery) else trigger_event_or_message
+    test_runs.start(state.key, "corsi")
     await state.set_state(CorsiTestStates.showing_sequence)
     await state.update_data(
         unique_id_for_test=profile_data.get('unique_id'),
@@ -478,6 +534,7 @@ async def start_corsi_test(trigger_event_or_message: [Message, CallbackQuery], s
         profile_telegram_id_for_test=profile_data.get('telegram_id'),
         current_sequence_length=2, error_count=0, sequence_times=[],
         correct_sequence=[], user_input_sequence=[], sequence_start_time=0,
+        user_input_received_ns=[], user_input_queue_ms=[],
         corsi_grid_message_id=None, corsi_status_message_id=None,
         corsi_chat_id=message_context.chat.id, corsi_feedback_message_id=None,
     )
@@ -487,6 +544,7 @@ async def start_corsi_test(trigger_event_or_message: [Message, CallbackQuery], s
 async def save_corsi_results(trigger_event_message: Message, state: FSMContext, is_interrupted: bool = False):
     data = await state.get_data()
     unique_id = data.get('unique_id_for_test')
+    bind_log_context(uid=unique_id, test="corsi")
     profile_telegram_id = data.get('profile_telegram_id_for_test')
     profile_name = data.get('profile_name_for_test')
     profile_age = data.get('profile_age_for_test')
@@ -494,7 +552,8 @@ async def save_corsi_results(trigger_event_message: Message, state: FSMContext,
     if not unique_id:
         current_state_for_error = await state.get_state()
         logger.error(
-            f"CRITICAL: 'unique_id_for_test' not found in FSM state for Corsi save (State: {current_state_for_error}). Interactor: {trigger_event_message.chat.id}. FSM Data: {data}")
+            "CRITICAL: 'unique_id_for_test' not found in FSM state for Corsi save (State: %s). Interactor: %s. "
+            "FSM keys: %s", current_state_for_error, trigger_event_message.chat.id, sorted(data))
         if current_state_for_error is not None:
             await trigger_event_message.answer("Тест Корси: критическая ошибка при сохранении (ID профиля не найден).")
         return
@@ -508,40 +567,29 @@ async def save_corsi_results(trigger_event_message: Message, state: FSMContext,
             total_avg_time_sum = sum(item['time'] / item['len'] for item in valid_sequences)
             corsi_avg_time_per_element = total_avg_time_sum / len(valid_sequences)
     corsi_detail_string = "; ".join([f"L{item['len']}:{item['time']:.2f}s" for item in sequence_times])
+    corsi_latency_string = corsi_latency_report(sequence_times)
+    if corsi_latency_string:
+        logger.info("Corsi timing for UID %s: %s", unique_id, corsi_latency_string)
     interruption_status = "Да" if is_interrupted else "Нет"
 
     try:
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        row_to_update = -1
-        for idx, row_cells in enumerate(ws.iter_rows(min_row=2), start=2):
-            if row_cells[1].value == unique_id:
-                row_to_update = idx
-                break
-
-        if row_to_update == -1:
-            logger.error(
-                f"UID {unique_id} for Corsi results not found in Excel. Appending profile data along with test results.")
-            new_row_data = [''] * len(ALL_EXPECTED_HEADERS)
-            new_row_data[ALL_EXPECTED_HEADERS.index("Telegram ID")] = profile_telegram_id
-            new_row_data[ALL_EXPECTED_HEADERS.index("Unique ID")] = unique_id
-            new_row_data[ALL_EXPECTED_HEADERS.index("Name")] = profile_name
-            new_row_data[ALL_EXPECTED_HEADERS.index("Age")] = profile_age
-            ws.append(new_row_data)
-            row_to_update = ws.max_row
-
-        ws.cell(row=row_to_update,
-                column=ALL_EXPECTED_HEADERS.index("Corsi - Max Correct Sequence Length") + 1).value = corsi_max_len
-        ws.cell(row=row_to_update,
-                column=ALL_EXPECTED_HEADERS.index("Corsi - Avg Time Per Element (s)") + 1).value = round(
-            corsi_avg_time_per_element, 2)
-        ws.cell(row=row_to_update,
-                column=ALL_EXPECTED_HEADERS.index("Corsi - Sequence Times Detail") + 1).value = corsi_detail_string
-        ws.cell(row=row_to_update,
-                column=ALL_EXPECTED_HEADERS.index("Corsi - Interrupted") + 1).value = interruption_status
-
-        wb.save(EXCEL_FILENAME)
-        logger.info(f"Corsi results for UID {unique_id} saved/updated. Interrupted: {is_interrupted}")
+        await results_store.update_results(
+            unique_id,
+            {
+                "Corsi - Max Correct Sequence Length": corsi_max_len,
+                "Corsi - Avg Time Per Element (s)": round(corsi_avg_time_per_element, 2),
+                "Corsi - Sequence Times Detail": corsi_detail_string,
+                "Corsi - Interrupted": interruption_status,
+                "Corsi - Tap Times (ms)": corsi_tap_times_detail(sequence_times),
+                "Corsi - Latency Report": corsi_latency_string,
+            },
+            profile={
+                "Telegram ID": profile_telegram_id,
+                "Name": profile_name,
+                "Age": profile_age,
+            },
+        )
+        logger.info("Corsi results for UID %s saved/updated. Interrupted: %s", unique_id, is_interrupted)
 
         current_state_for_summary = await state.get_state()
         if current_state_for_summary is not None:
@@ -553,21 +601,35 @@ async def save_corsi_results(trigger_event_message: Message, state: FSMContext,
             )
             if is_interrupted and corsi_max_len == 0 and not sequence_times:
                 summary_text = f"Тест Корси <b>ПРЕРВАН</b> досрочно. Результаты не зафиксированы."
-            await trigger_event_message.answer(summary_text, parse_mode=ParseMode.HTML)
+            with outbound_priority(PRIORITY_BULK):
+                await trigger_event_message.answer(summary_text, parse_mode=ParseMode.HTML)
 
     except Exception as e:
-        logger.error(f"Error saving Corsi results to Excel for UID {unique_id}: {e}")
+        logger.error("Error saving Corsi results to Excel for UID %s: %s", unique_id, e)
         current_state_for_error_msg = await state.get_state()
         if current_state_for_error_msg is not None:
             await trigger_event_message.answer("Произошла ошибка при сохранении результатов Теста Корси.")
 
 
-# --- Stroop Test Skeletons ---
+# --- Stroop Test Logic ---
+stroop_timer = TimingScheduler()
+
+STROOP_TRIALS_PER_PART = getattr(config, "STROOP_TRIALS_PER_PART", 10)
+STROOP_READY_PAUSE = 1.5  # "Приготовьтесь..." before the first stimulus of a part
+STROOP_PART_STATES = {
+    1: (StroopTestStates.part1_display, StroopTestStates.part1_response),
+    2: (StroopTestStates.part2_display, StroopTestStates.part2_response),
+    3: (StroopTestStates.part3_display, StroopTestStates.part3_response),
+}
+
+
 async def start_stroop_test(trigger_event_or_message: [Message, CallbackQuery], state: FSMContext, profile_data: dict):
-    logger.info(f"Placeholder: Starting Stroop Test for UID: {profile_data.get('unique_id')}")
+    bind_log_context(uid=profile_data.get('unique_id'), test="stroop")
+    logger.info("Starting Stroop Test for UID: %s", profile_data.get('unique_id'))
     message_context = trigger_event_or_message.message if isinstance(trigger_event_or_message,
                                                                      CallbackQuery) else trigger_event_or_message
 
+    test_runs.start(state.key, "stroop")
     await state.set_state(StroopTestStates.part1_display)
     await state.update_data(
         unique_id_for_test=profile_data.get('unique_id'),
@@ -577,47 +639,133 @@ async def start_stroop_test(trigger_event_or_message: [Message, CallbackQuery],
         stroop_part1_time_total=None, stroop_part1_errors_total=None,
         stroop_part2_time_total=None, stroop_part2_errors_total=None,
         stroop_part3_time_total=None, stroop_part3_errors_total=None,
-        stroop_current_trial=0,
-        stroop_stimuli_colors=["Красный", "Синий", "Зеленый", "Желтый", "Черный"],
+        # The whole session is generated up front; answering a trial is a lookup in these lists.
+        stroop_decks=[generate_stroop_deck(part, STROOP_TRIALS_PER_PART) for part in STROOP_PARTS],
+        stroop_part=1, stroop_current_trial=0, stroop_trial_shown_ns=None,
+        stroop_trial_times_ms=[], stroop_part_errors=0,
         stroop_chat_id=message_context.chat.id,
         stroop_main_message_id=None,
     )
-    msg = await message_context.answer(
-        f"Тест Струпа (Часть 1 - в разработке).\nНажмите кнопку, чтобы 'начать'.",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [IKB(text="Начать часть 1 (пример)", callback_data="stroop_p1_next")]
-        ]))
+    msg = await message_context.answer(STROOP_PART_INTROS[1], reply_markup=STROOP_START_MARKUP)
     await state.update_data(stroop_main_message_id=msg.message_id)
 
 
-async def handle_stroop_part1_response(callback: CallbackQuery, state: FSMContext):
-    logger.info("Placeholder: Handling Stroop Part 1 response.")
-    await callback.answer("Часть 1 Струпа - ответ получен (пример).")
+async def show_stroop_trial(chat_id: int, message_id: int, part: int, deck: list, trial: int) -> int:
+    """Puts trial `trial` on screen with one edit; returns when Telegram confirmed it (monotonic ns)."""
+    with outbound_priority(PRIORITY_TIMING):
+        await bot.edit_message_text(text=stroop_trial_text(part, deck, trial), chat_id=chat_id,
+                                    message_id=message_id, reply_markup=stroop_answer_markup(trial))
+    return time.monotonic_ns()
 
-    await save_stroop_results(callback.message, state, is_interrupted=False)
-    await cleanup_stroop_ui(state, bot, final_text="Тест Струпа (пример) завершен.")
 
-    fsm_data_after_test_cleanup = await state.get_data()
-    main_profile_data_to_keep = {}
-    if "active_unique_id" in fsm_data_after_test_cleanup:
-        main_profile_data_to_keep["active_unique_id"] = fsm_data_after_test_cleanup.get("active_unique_id")
-        main_profile_data_to_keep["active_name"] = fsm_data_after_test_cleanup.get("active_name")
-        main_profile_data_to_keep["active_age"] = fsm_data_after_test_cleanup.get("active_age")
-        main_profile_data_to_keep["active_telegram_id"] = fsm_data_after_test_cleanup.get("active_telegram_id")
+async def handle_stroop_part_start(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    part = data.get('stroop_part', 1)
+    chat_id = data.get('stroop_chat_id')
+    message_id = data.get('stroop_main_message_id')
+    if not chat_id or not message_id:
+        await callback.answer("Тест был прерван или завершен.", show_alert=True)
+        logger.warning("Stroop part %s start pressed without a running Stroop test.", part)
+        state.discard()
+        return
+    run = test_runs.resume(state.key, "stroop")
+
+    await callback.answer()
+    try:
+        await bot.edit_message_text(text="Приготовьтесь...", chat_id=chat_id, message_id=message_id,
+                                    reply_markup=None)
+    except TelegramBadRequest as e:
+        logger.error("Error editing Stroop message before part %s: %s", part, e)
+        return
+    await state.set_state(STROOP_PART_STATES[part][1])
+    await state.update_data(stroop_current_trial=0, stroop_trial_shown_ns=None, stroop_trial_times_ms=[],
+                            stroop_part_errors=0)
+    await state.flush()
+
+    plan = stroop_timer.plan(f"Stroop part {part} for chat {chat_id}")
+    run.run_plan(plan)
+    plan.at(STROOP_READY_PAUSE, functools.partial(
+        begin_stroop_part, state, plan, chat_id, message_id, part, data['stroop_decks'][part - 1]), compensate=False)
+
+
+async def begin_stroop_part(state: FSMContext, plan: TimedPlan, chat_id: int, message_id: int, part: int,
+                            deck: list):
+    """Plan step: shows the first stimulus of the part and starts the clock."""
+    try:
+        shown_ns = await show_stroop_trial(chat_id, message_id, part, deck, 0)
+    except TelegramBadRequest as e:
+        logger.warning("Stroop message not found for the first trial of part %s: %s", part, e)
+        return
+    if plan.cancelled:
+        state.discard()
+        logger.info("Stroop part %s cancelled while showing the first trial; aborting.", part)
+        return
+    await state.update_data(stroop_trial_shown_ns=shown_ns)
+    await state.flush()
+
+
+async def handle_stroop_answer(callback: CallbackQuery, state: FSMContext, received_ns: int = None):
+    received_ns = received_ns or time.monotonic_ns()
+    _, _, answered_trial, color = callback.data.split("_")
+    data = await state.get_data()
+    bind_log_context(uid=data.get('unique_id_for_test'))
+    trial = data.get('stroop_current_trial', 0)
+    shown_ns = data.get('stroop_trial_shown_ns')
+    await callback.answer()
+    if int(answered_trial) != trial or shown_ns is None:
+        return  # a second tap on a stimulus that has already been answered
+
+    part = data.get('stroop_part', 1)
+    deck = data['stroop_decks'][part - 1]
+    trial_times_ms = data.get('stroop_trial_times_ms', []) + [ns_to_ms(received_ns - shown_ns)]
+    errors = data.get('stroop_part_errors', 0) + (int(color) != stroop_ink(deck[trial]))
+    if trial + 1 < len(deck):
+        try:
+            shown_ns = await show_stroop_trial(data['stroop_chat_id'], data['stroop_main_message_id'], part, deck,
+                                               trial + 1)
+        except TelegramBadRequest as e:
+            logger.error("Error showing Stroop trial %s of part %s: %s", trial + 2, part, e)
+            return
+        await state.update_data(stroop_current_trial=trial + 1, stroop_trial_shown_ns=shown_ns,
+                                stroop_trial_times_ms=trial_times_ms, stroop_part_errors=errors)
+        return
+    await finish_stroop_part(callback.message, state, part, trial_times_ms, errors)
 
-    await state.set_state(None)
-    if main_profile_data_to_keep.get("active_unique_id"):
-        await state.set_data(main_profile_data_to_keep)
-        await send_main_action_menu(callback.message, ACTION_SELECTION_KEYBOARD_RETURNING, state=state)
-    else:
-        await callback.message.answer("Тест завершен, но профиль не найден. /start")
-        await state.clear()
+
+async def finish_stroop_part(message_context: Message, state: FSMContext, part: int, trial_times_ms: list,
+                             errors: int):
+    data = await state.update_data(**{
+        f"stroop_part{part}_time_total": stroop_part_time(trial_times_ms),
+        f"stroop_part{part}_errors_total": errors,
+    })
+    logger.info("Stroop part %s for UID %s: %s s, %s errors, trials (ms) %s", part, data.get('unique_id_for_test'),
+                stroop_part_time(trial_times_ms), errors, trial_times_ms)
+
+    if part < len(STROOP_PARTS):
+        await state.set_state(STROOP_PART_STATES[part + 1][0])
+        await state.update_data(stroop_part=part + 1, stroop_current_trial=0, stroop_trial_shown_ns=None)
+        try:
+            await bot.edit_message_text(text=STROOP_PART_INTROS[part + 1], chat_id=data['stroop_chat_id'],
+                                        message_id=data['stroop_main_message_id'], reply_markup=STROOP_START_MARKUP)
+        except TelegramBadRequest as e:
+            logger.error("Error showing Stroop part %s instructions: %s", part + 1, e)
+        return
+
+    await complete_test(message_context, state, TEST_REGISTRY["initiate_stroop_test"], is_interrupted=False,
+                        final_text="Тест Струпа завершен.",
+                        no_profile_text="Тест завершен, но профиль не найден. /start")
+
+
+async def on_stroop_stop(callback: CallbackQuery, state: FSMContext):
+    await callback.answer(text='Тест Струпа будет прерван.', show_alert=False)
+    await stop_test_command_handler(callback.message, state, called_from_test_button=True)
 
 
 async def save_stroop_results(trigger_event_message: Message, state: FSMContext, is_interrupted: bool = False):
-    logger.info(f"Saving Stroop Test results. Interrupted: {is_interrupted}")
     data = await state.get_data()
     unique_id = data.get('unique_id_for_test')
+    bind_log_context(uid=unique_id, test="stroop")
+    logger.info("Saving Stroop Test results. Interrupted: %s", is_interrupted)
     profile_telegram_id = data.get('profile_telegram_id_for_test')
     profile_name = data.get('profile_name_for_test')
     profile_age = data.get('profile_age_for_test')
@@ -625,7 +773,8 @@ async def save_stroop_results(trigger_event_message: Message, state: FSMContext,
     if not unique_id:
         current_state_for_error = await state.get_state()
         logger.error(
-            f"CRITICAL: 'unique_id_for_test' not found for Stroop save (State: {current_state_for_error}). Interactor: {trigger_event_message.chat.id}. FSM Data: {data}")
+            "CRITICAL: 'unique_id_for_test' not found for Stroop save (State: %s). Interactor: %s. FSM keys: %s",
+            current_state_for_error, trigger_event_message.chat.id, sorted(data))
         if current_state_for_error is not None:
             await trigger_event_message.answer("Тест Струпа: критическая ошибка при сохранении (ID профиля не найден).")
         return
@@ -639,49 +788,40 @@ async def save_stroop_results(trigger_event_message: Message, state: FSMContext,
     interruption_status_stroop = "Да" if is_interrupted else "Нет"
 
     try:
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        row_to_update = -1
-        for idx, row_cells in enumerate(ws.iter_rows(min_row=2), start=2):
-            if row_cells[1].value == unique_id:
-                row_to_update = idx
-                break
-        if row_to_update == -1:
-            logger.error(
-                f"UID {unique_id} for Stroop results not found in Excel. Appending profile data along with test results.")
-            new_row_data = [''] * len(ALL_EXPECTED_HEADERS)
-            new_row_data[
-                ALL_EXPECTED_HEADERS.index("Telegram ID")] = profile_telegram_id if profile_telegram_id else data.get(
-                'active_telegram_id', 'N/A_ExcelError')
-            new_row_data[ALL_EXPECTED_HEADERS.index("Unique ID")] = unique_id
-            new_row_data[ALL_EXPECTED_HEADERS.index("Name")] = profile_name if profile_name else data.get('active_name',
-                                                                                                          'N/A_ExcelError')
-            new_row_data[ALL_EXPECTED_HEADERS.index("Age")] = profile_age if profile_age else data.get('active_age',
-                                                                                                       'N/A_ExcelError')
-            ws.append(new_row_data)
-            row_to_update = ws.max_row
-
-        ws.cell(row=row_to_update, column=ALL_EXPECTED_HEADERS.index("Stroop Part1 Time (s)") + 1).value = p1_time
-        ws.cell(row=row_to_update, column=ALL_EXPECTED_HEADERS.index("Stroop Part1 Errors") + 1).value = p1_errors
-        ws.cell(row=row_to_update, column=ALL_EXPECTED_HEADERS.index("Stroop Part2 Time (s)") + 1).value = p2_time
-        ws.cell(row=row_to_update, column=ALL_EXPECTED_HEADERS.index("Stroop Part2 Errors") + 1).value = p2_errors
-        ws.cell(row=row_to_update, column=ALL_EXPECTED_HEADERS.index("Stroop Part3 Time (s)") + 1).value = p3_time
-        ws.cell(row=row_to_update, column=ALL_EXPECTED_HEADERS.index("Stroop Part3 Errors") + 1).value = p3_errors
-        ws.cell(row=row_to_update,
-                column=ALL_EXPECTED_HEADERS.index("Stroop - Interrupted") + 1).value = interruption_status_stroop
-
-        wb.save(EXCEL_FILENAME)
-        logger.info(f"Stroop results for UID {unique_id} saved/updated. Interrupted: {is_interrupted}")
+        await results_store.update_results(
+            unique_id,
+            {
+                "Stroop Part1 Time (s)": p1_time,
+                "Stroop Part1 Errors": p1_errors,
+                "Stroop Part2 Time (s)": p2_time,
+                "Stroop Part2 Errors": p2_errors,
+                "Stroop Part3 Time (s)": p3_time,
+                "Stroop Part3 Errors": p3_errors,
+                "Stroop - Interrupted": interruption_status_stroop,
+            },
+            profile={
+                "Telegram ID": profile_telegram_id if profile_telegram_id else data.get(
+                    'active_telegram_id', 'N/A_ExcelError'),
+                "Name": profile_name if profile_name else data.get('active_name', 'N/A_ExcelError'),
+                "Age": profile_age if profile_age else data.get('active_age', 'N/A_ExcelError'),
+            },
+        )
+        logger.info("Stroop results for UID %s saved/updated. Interrupted: %s", unique_id, is_interrupted)
 
         current_state_for_summary = await state.get_state()
         if current_state_for_summary is not None:
-            summary_text_stroop = f"Результаты Теста Струпа {'<b>ПРЕРВАНЫ</b>' if is_interrupted else '<b>СОХРАНЕНЫ</b> (в разработке)'}."
+            part_lines = [f"Часть {part}: {data.get(f'stroop_part{part}_time_total')} сек, "
+                          f"ошибок: {data.get(f'stroop_part{part}_errors_total')}"
+                          for part in STROOP_PARTS if data.get(f"stroop_part{part}_time_total") is not None]
+            summary_text_stroop = "\n".join(
+                [f"Тест Струпа {'<b>ПРЕРВАН</b>' if is_interrupted else '<b>ЗАВЕРШЕН</b>'}!"] + part_lines)
             if is_interrupted and p1_time is None and p1_errors is None:
                 summary_text_stroop = f"Тест Струпа <b>ПРЕРВАН</b> досрочно. Результаты не зафиксированы."
-            await trigger_event_message.answer(summary_text_stroop, parse_mode=ParseMode.HTML)
+            with outbound_priority(PRIORITY_BULK):
+                await trigger_event_message.answer(summary_text_stroop, parse_mode=ParseMode.HTML)
 
     except Exception as e:
-        logger.error(f"Error saving Stroop results to Excel for UID {unique_id}: {e}")
+        logger.error("Error saving Stroop results to Excel for UID %s: %s", unique_id, e)
         current_state_for_error_msg = await state.get_state()
         if current_state_for_error_msg is not None:
             await trigger_event_message.answer("Произошла ошибка при сохранении результатов Теста Струпа.")
@@ -689,6 +829,7 @@ async def save_stroop_results(trigger_event_message: Message, state: FSMContext,
 
 async def cleanup_stroop_ui(state: FSMContext, bot_instance: Bot,
                             final_text: str = "Тест Струпа завершен или отменен."):
+    test_runs.cancel(state.key)
     data = await state.get_data()
     chat_id = data.get('stroop_chat_id')
     main_message_id = data.get('stroop_main_message_id')
@@ -706,7 +847,7 @@ async def cleanup_stroop_ui(state: FSMContext, bot_instance: Bot,
         'stroop_part1_time_total', 'stroop_part1_errors_total',
         'stroop_part2_time_total', 'stroop_part2_errors_total',
         'stroop_part3_time_total', 'stroop_part3_errors_total',
-        'stroop_stimuli_colors'
+        'stroop_decks', 'stroop_part', 'stroop_trial_shown_ns', 'stroop_trial_times_ms', 'stroop_part_errors'
     ]
     current_fsm_data = await state.get_data()
     data_after_stroop_message_cleanup = {k: v for k, v in current_fsm_data.items() if
@@ -715,45 +856,13 @@ async def cleanup_stroop_ui(state: FSMContext, bot_instance: Bot,
 
 
 # --- Test Registry ---
-async def check_if_corsi_results_exist(profile_unique_id: int) -> bool:
-    if not profile_unique_id: return False
+async def completed_tests_mask(profile_unique_id: int) -> int:
+    if not profile_unique_id: return 0
     try:
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        corsi_cols_indices = [
-            ALL_EXPECTED_HEADERS.index("Corsi - Max Correct Sequence Length") + 1,
-            ALL_EXPECTED_HEADERS.index("Corsi - Avg Time Per Element (s)") + 1,
-            ALL_EXPECTED_HEADERS.index("Corsi - Sequence Times Detail") + 1
-        ]
-        for row_cells_tuple in ws.iter_rows(min_row=2):
-            if row_cells_tuple[1].value == profile_unique_id:
-                for col_idx in corsi_cols_indices:
-                    if ws.cell(row=row_cells_tuple[0].row, column=col_idx).value is not None:
-                        return True
-        return False
+        return await results_store.completed_tests(profile_unique_id)
     except Exception as e:
-        logger.error(f"Excel check error for Corsi results (UID {profile_unique_id}): {e}")
-        return False
-
-
-async def check_if_stroop_results_exist(profile_unique_id: int) -> bool:
-    if not profile_unique_id: return False
-    try:
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        stroop_cols_indices = [
-            ALL_EXPECTED_HEADERS.index("Stroop Part1 Time (s)") + 1,
-            ALL_EXPECTED_HEADERS.index("Stroop Part1 Errors") + 1,
-        ]
-        for row_cells_tuple in ws.iter_rows(min_row=2):
-            if row_cells_tuple[1].value == profile_unique_id:
-                for col_idx in stroop_cols_indices:
-                    if ws.cell(row=row_cells_tuple[0].row, column=col_idx).value is not None:
-                        return True
-        return False
-    except Exception as e:
-        logger.error(f"Excel check error for Stroop results (UID {profile_unique_id}): {e}")
-        return False
+        logger.error("Results check error (UID %s): %s", profile_unique_id, e)
+        return 0
 
 
 TEST_REGISTRY = {
@@ -763,21 +872,66 @@ TEST_REGISTRY = {
         "start_function": start_corsi_test,
         "save_function": save_corsi_results,
         "cleanup_function": cleanup_corsi_messages,
-        "results_exist_check": check_if_corsi_results_exist,
+        "result_group": "corsi",
+        "result_headers": CORSI_HEADERS,
         "requires_active_profile": True,
     },
     "initiate_stroop_test": {
-        "name": "Тест Струпа (в разработке)",
+        "name": "Тест Струпа",
         "fsm_group_class": StroopTestStates,
         "start_function": start_stroop_test,
         "save_function": save_stroop_results,
         "cleanup_function": cleanup_stroop_ui,
-        "results_exist_check": check_if_stroop_results_exist,
+        "result_group": "stroop",
+        "result_headers": STROOP_HEADERS,
         "requires_active_profile": True,
     }
 }
 
 
+def active_test_counts() -> dict:
+    counts = test_runs.counts()
+    return {key: counts[info["result_group"]] for key, info in TEST_REGISTRY.items()}
+
+
+bot_metrics.active_tests = active_test_counts
+log_context_middleware.test_groups = {
+    info["fsm_group_class"].__name__: info["result_group"] for info in TEST_REGISTRY.values()
+}
+
+
+async def complete_test(message_context: Message, state: FSMContext, test_config: dict, is_interrupted: bool,
+                        final_text: str, no_profile_text: str) -> dict:
+    """Saves the results, closes the test's messages and brings back the menu; returns the kept profile."""
+    data = await state.get_data()
+    main_profile_data_to_keep = {}
+    if data.get("active_unique_id"):
+        main_profile_data_to_keep = {key: data.get(key) for key in (
+            "active_unique_id", "active_name", "active_age", "active_telegram_id")}
+
+    if main_profile_data_to_keep:
+        closing_message = functools.partial(send_main_action_menu, message_context,
+                                            ACTION_SELECTION_KEYBOARD_RETURNING, state=state)
+    else:
+        closing_message = functools.partial(message_context.answer, no_profile_text)
+    # The summary (sent by the save function) has to stay above the menu; closing the grid and deleting
+    # the status messages overlap with both. The save function takes its copy of the test's FSM data
+    # first thing, and the cleanup drops that data only once its own calls are done.
+    await concurrently(
+        in_order(functools.partial(test_config["save_function"], message_context, state,
+                                   is_interrupted=is_interrupted),
+                 closing_message),
+        test_config["cleanup_function"](state, bot, final_text=final_text),
+    )
+
+    await state.set_state(None)
+    if main_profile_data_to_keep:
+        await state.set_data(main_profile_data_to_keep)
+    else:
+        await state.clear()
+    return main_profile_data_to_keep
+
+
 # --- /stoptest Command Handler ---
 @dp.message(Command("stoptest"))
 async def stop_test_command_handler(message: Message, state: FSMContext, called_from_test_button: bool = False):
@@ -793,33 +947,23 @@ async def stop_test_command_handler(message: Message, state: FSMContext, called_
                 break
 
     if active_test_config:
+        test_runs.cancel(state.key)
         if not called_from_test_button:
             await message.answer(f"Останавливаю тест: {active_test_config['name']}...")
 
-        await active_test_config["save_function"](message, state, is_interrupted=True)
-        await active_test_config["cleanup_function"](state, bot,
-                                                     final_text=f"Тест {active_test_config['name']} был прерван.")
-
-        fsm_data_after_test_cleanup = await state.get_data()
-        main_profile_data_to_keep = {}
-        if "active_unique_id" in fsm_data_after_test_cleanup:
-            main_profile_data_to_keep["active_unique_id"] = fsm_data_after_test_cleanup.get("active_unique_id")
-            main_profile_data_to_keep["active_name"] = fsm_data_after_test_cleanup.get("active_name")
-            main_profile_data_to_keep["active_age"] = fsm_data_after_test_cleanup.get("active_age")
-            main_profile_data_to_keep["active_telegram_id"] = fsm_data_after_test_cleanup.get("active_telegram_id")
-
-        await state.set_state(None)
-
-        if main_profile_data_to_keep.get("active_unique_id"):
-            await state.set_data(main_profile_data_to_keep)
-            await send_main_action_menu(message, ACTION_SELECTION_KEYBOARD_RETURNING, state=state)
+        main_profile_data_to_keep = await complete_test(
+            message, state, active_test_config, is_interrupted=True,
+            final_text=f"Тест {active_test_config['name']} был прерван.",
+            no_profile_text="Тест остановлен. Ваш профиль не активен, пожалуйста, используйте /start.",
+        )
+        if main_profile_data_to_keep:
             logger.info(
-                f"Test '{active_test_config['name']}' stopped. User {message.from_user.id} (UID: {main_profile_data_to_keep.get('active_unique_id')}) returned to menu.")
+                "Test '%s' stopped. User %s (UID: %s) returned to menu.", active_test_config['name'],
+                message.from_user.id, main_profile_data_to_keep.get('active_unique_id'))
         else:
-            await message.answer("Тест остановлен. Ваш профиль не активен, пожалуйста, используйте /start.")
             logger.warning(
-                f"Test '{active_test_config['name']}' stopped, but no active_profile data found to restore after cleanup. User {message.from_user.id}")
-            await state.clear()
+                "Test '%s' stopped, but no active_profile data found to restore after cleanup. User %s",
+                active_test_config['name'], message.from_user.id)
     elif not called_from_test_button:
         await message.answer("Нет активного теста для остановки. Вы можете выбрать тест из меню (команда /start).")
 
@@ -836,10 +980,13 @@ async def on_select_specific_test_callback(cb: CallbackQuery, state: FSMContext)
             pass
         return
 
+    completed_mask = await completed_tests_mask(active_profile.get("unique_id"))
     buttons = []
     for test_key, config in TEST_REGISTRY.items():
         if config.get("requires_active_profile", True):
-            buttons.append([IKB(text=config["name"], callback_data=f"select_test_{test_key}")])
+            completed = completed_mask & RESULT_BITS[config["result_group"]]
+            buttons.append([IKB(text=f"✅ {config['name']}" if completed else config["name"],
+                                callback_data=f"select_test_{test_key}")])
 
     if not buttons:
         await cb.message.edit_text("Нет доступных тестов для выбора.", reply_markup=None)
@@ -848,10 +995,11 @@ async def on_select_specific_test_callback(cb: CallbackQuery, state: FSMContext)
 
     await cb.answer()
     kbd = InlineKeyboardMarkup(inline_keyboard=buttons)
+    menu_text = "Выберите тест:" + ("\n✅ — результаты уже сохранены." if completed_mask else "")
     try:
-        await cb.message.edit_text("Выберите тест:", reply_markup=kbd)
+        await cb.message.edit_text(menu_text, reply_markup=kbd)
     except TelegramBadRequest:
-        await cb.message.answer("Выберите тест:", reply_markup=kbd)
+        await cb.message.answer(menu_text, reply_markup=kbd)
 
 
 @dp.callback_query(F.data.startswith("select_test_"))
@@ -860,7 +1008,7 @@ async def on_test_selected_callback(cb: CallbackQuery, state: FSMContext):
 
     if test_key_selected not in TEST_REGISTRY:
         await cb.answer("Выбранный тест не найден.", show_alert=True)
-        logger.warning(f"Unknown test key selected: {test_key_selected}")
+        logger.warning("Unknown test key selected: %s", test_key_selected)
         return
 
     test_config = TEST_REGISTRY[test_key_selected]
@@ -873,8 +1021,8 @@ async def on_test_selected_callback(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     await state.update_data(pending_test_key_for_overwrite=test_key_selected)
 
-    results_exist = await test_config["results_exist_check"](
-        active_profile.get("unique_id")) if active_profile else False
+    completed_mask = await completed_tests_mask(active_profile.get("unique_id")) if active_profile else 0
+    results_exist = bool(completed_mask & RESULT_BITS[test_config["result_group"]])
 
     if results_exist:
         confirm_kbd = InlineKeyboardMarkup(inline_keyboard=[
@@ -886,7 +1034,9 @@ async def on_test_selected_callback(cb: CallbackQuery, state: FSMContext):
                 f"У вас есть сохраненные результаты для теста '{test_config['name']}'. Перезаписать их?",
                 reply_markup=confirm_kbd
             )
-            await state.update_data(overwrite_confirmation_message_id=msg.message_id)
+            # True instead of a Message when the edit changed nothing (see EditDeduplicator).
+            await state.update_data(
+                overwrite_confirmation_message_id=msg.message_id if isinstance(msg, Message) else cb.message.message_id)
         except TelegramBadRequest:
             msg = await cb.message.answer(
                 f"У вас есть сохраненные результаты для теста '{test_config['name']}'. Перезаписать их?",
@@ -964,6 +1114,7 @@ async def on_run_test_battery_callback(cb: CallbackQuery, state: FSMContext):
 # --- Registration and Main Menu Handlers ---
 @dp.message(CommandStart())
 async def start_command_handler(message: Message, state: FSMContext):
+    test_runs.cancel(state.key)
     await state.clear()
     await state.set_state(UserData.waiting_for_first_time_response)
     first_time_kbd = InlineKeyboardMarkup(
@@ -1010,19 +1161,17 @@ async def process_unique_id_input(message: Message, state: FSMContext):
         return
 
     try:
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
         user_profile_data = None
-        for row_idx, row_cells_tuple in enumerate(ws.iter_rows(min_row=2), start=2):
-            if row_cells_tuple[1].value == entered_unique_id:
-                user_profile_data = {
-                    "active_unique_id": entered_unique_id,
-                    "active_telegram_id": row_cells_tuple[0].value,
-                    "active_name": str(row_cells_tuple[2].value),
-                    "active_age": str(row_cells_tuple[3].value),
-                }
-                logger.info(f"User authenticated via UID: {entered_unique_id}. Profile: {user_profile_data}")
-                break
+        profile_row = await results_store.find_by_uid(entered_unique_id)
+        if profile_row:
+            user_profile_data = {
+                "active_unique_id": entered_unique_id,
+                "active_telegram_id": profile_row.get("Telegram ID"),
+                "active_name": str(profile_row.get("Name")),
+                "active_age": str(profile_row.get("Age")),
+            }
+            bind_log_context(uid=entered_unique_id)
+            logger.info("User authenticated via UID: %s.", entered_unique_id)
 
         if user_profile_data:
             await state.set_data(user_profile_data)
@@ -1036,7 +1185,7 @@ async def process_unique_id_input(message: Message, state: FSMContext):
             ])
             await message.answer("Уникальный идентификатор (UID) не найден.", reply_markup=kbd)
     except Exception as e:
-        logger.error(f"Error during UID check for '{message.text}': {e}")
+        logger.error("Error during UID check for '%s': %s", message.text, e)
         await message.answer("Произошла ошибка при проверке UID. Попробуйте позже или свяжитесь с администратором.")
 
 
@@ -1086,41 +1235,29 @@ async def process_age_input(message: Message, state: FSMContext):
 
     new_unique_id = None
     try:
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        existing_ids = {row[1].value for row in ws.iter_rows(min_row=2) if row[1].value is not None}
-
-        min_uid, max_uid = 1000000, 9999999
-        if len(existing_ids) >= (max_uid - min_uid + 1):
-            await message.answer(
-                "Критическая ошибка: не удалось сгенерировать UID, все идентификаторы исчерпаны. Свяжитесь с администратором.")
-            logger.critical("All 7-digit UIDs seem to be exhausted.")
-            await state.clear()
-            return
-
-        attempts = 0
-        while attempts < 1000:
-            new_unique_id = random.randint(min_uid, max_uid)
-            if new_unique_id not in existing_ids:
+        # Only UIDs written behind the allocator's back (by hand, or by another bot instance) can be taken here.
+        for _ in range(10):
+            candidate_unique_id = uid_allocator.allocate()
+            if candidate_unique_id is None:
+                break
+            if not await results_store.uid_exists(candidate_unique_id):
+                new_unique_id = candidate_unique_id
                 break
-            attempts += 1
-        if new_unique_id is None or new_unique_id in existing_ids:
+            # Taken by another instance sharing the store: catch up on everything it has registered.
+            logger.warning("Allocated UID %s already exists in storage; reloading used UIDs.", candidate_unique_id)
+            await uid_allocator.load(results_store)
+        if new_unique_id is None:
             await message.answer(
-                "Критическая ошибка: не удалось сгенерировать уникальный UID после множества попыток. Свяжитесь с администратором.")
-            logger.critical(f"Failed to generate a unique 7-digit UID after {attempts} attempts.")
+                "Критическая ошибка: не удалось сгенерировать UID, все идентификаторы исчерпаны. Свяжитесь с администратором.")
+            logger.critical("Failed to allocate a unique 7-digit UID in 10 attempts.")
             await state.clear()
             return
 
-        new_user_row = [''] * len(ALL_EXPECTED_HEADERS)
-        new_user_row[ALL_EXPECTED_HEADERS.index("Telegram ID")] = current_telegram_id
-        new_user_row[ALL_EXPECTED_HEADERS.index("Unique ID")] = new_unique_id
-        new_user_row[ALL_EXPECTED_HEADERS.index("Name")] = name_to_register
-        new_user_row[ALL_EXPECTED_HEADERS.index("Age")] = age_to_register
-
-        ws.append(new_user_row)
-        wb.save(EXCEL_FILENAME)
+        await results_store.create_profile(current_telegram_id, new_unique_id, name_to_register, age_to_register)
+        bind_log_context(uid=new_unique_id)
         logger.info(
-            f"New user registered: TG ID: {current_telegram_id}, UID: {new_unique_id}, Name: {name_to_register}, Age: {age_to_register}")
+            "New user registered: TG ID: %s, UID: %s, Name: %s, Age: %s", current_telegram_id, new_unique_id,
+            name_to_register, age_to_register)
 
         active_profile_data = {
             'active_telegram_id': current_telegram_id,
@@ -1139,7 +1276,7 @@ async def process_age_input(message: Message, state: FSMContext):
         await send_main_action_menu(message, ACTION_SELECTION_KEYBOARD_NEW, state=state)
 
     except Exception as e:
-        logger.error(f"Error during new user registration (UID generation or Excel save): {e}", exc_info=True)
+        logger.error("Error during new user registration (UID generation or Excel save): %s", e, exc_info=True)
         await message.answer(
             "Произошла ошибка во время регистрации. Пожалуйста, попробуйте позже или свяжитесь с администратором.")
         await state.clear()
@@ -1157,48 +1294,71 @@ async def show_my_data_command(message: Message, state: FSMContext):
     response_lines = [f"Данные для активного профиля UID: <b>{uid_to_show}</b>"]
 
     try:
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        profile_found_in_excel = False
-        for row_cells_tuple in ws.iter_rows(min_row=2):
-            if row_cells_tuple[1].value == uid_to_show:
-                profile_found_in_excel = True
-                for i, header_name in enumerate(ALL_EXPECTED_HEADERS):
-                    cell_value = row_cells_tuple[i].value
-                    if "Interrupted" in header_name and cell_value is not None:
-                        display_value = "Да" if cell_value == "Да" else ("Нет" if cell_value == "Нет" else cell_value)
-                    else:
-                        display_value = cell_value if cell_value is not None else "нет данных"
-                    response_lines.append(f"<b>{header_name}:</b> {display_value}")
-                break
+        profile_row = await results_store.find_by_uid(uid_to_show)
+        profile_found_in_excel = profile_row is not None
+        if profile_found_in_excel:
+            for header_name in ALL_EXPECTED_HEADERS:
+                cell_value = profile_row.get(header_name)
+                if "Interrupted" in header_name and cell_value is not None:
+                    display_value = "Да" if cell_value == "Да" else ("Нет" if cell_value == "Нет" else cell_value)
+                else:
+                    display_value = cell_value if cell_value is not None else "нет данных"
+                response_lines.append(f"<b>{header_name}:</b> {display_value}")
         if not profile_found_in_excel:
             response_lines.append("Профиль с таким UID не найден в базе данных (Excel). Это неожиданно.")
-            logger.warning(f"/mydata: Active UID {uid_to_show} from FSM not found in Excel.")
+            logger.warning("/mydata: Active UID %s from FSM not found in Excel.", uid_to_show)
 
     except FileNotFoundError:
         response_lines.append("Файл данных не найден. Свяжитесь с администратором.")
-        logger.error(f"/mydata: Excel file '{EXCEL_FILENAME}' not found.")
+        logger.error("/mydata: Excel file '%s' not found.", EXCEL_FILENAME)
     except Exception as e:
         response_lines.append("Ошибка при загрузке данных. Свяжитесь с администратором.")
-        logger.error(f"Error loading Excel for /mydata (UID: {uid_to_show}): {e}")
+        logger.error("Error loading Excel for /mydata (UID: %s): %s", uid_to_show, e)
 
     await message.answer("\n".join(response_lines), parse_mode=ParseMode.HTML)
 
 
 @dp.message(Command("export"))
-async def export_data_to_excel_command(message: Message, state: FSMContext):
-    if os.path.exists(EXCEL_FILENAME):
-        try:
-            await message.reply_document(FSInputFile(EXCEL_FILENAME), caption="Данные пользователей.")
-        except Exception as e:
-            logger.error(f"Error sending Excel file: {e}")
-            await message.answer("Не удалось отправить файл. Попробуйте позже.")
-    else:
-        await message.answer(f"Файл данных '{EXCEL_FILENAME}' не найден.")
+async def export_data_to_excel_command(message: Message, state: FSMContext, command: CommandObject):
+    # /export [xlsx|csv|csv.gz] [corsi|stroop] [YYYY-MM-DD [YYYY-MM-DD]]
+    export_format = "xlsx"
+    test_config = None
+    dates = []
+    for arg in (command.args or "").lower().split():
+        matching_tests = [config for test_key, config in TEST_REGISTRY.items() if arg in test_key]
+        if arg in EXPORT_FORMATS:
+            export_format = arg
+        elif len(arg) == 10 and arg[4] == "-" and arg[7] == "-" and arg.replace("-", "").isdigit():
+            dates.append(arg)
+        elif len(matching_tests) == 1:
+            test_config = matching_tests[0]
+        else:
+            await message.answer(
+                "Использование: /export [xlsx|csv|csv.gz] [corsi|stroop] [ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]]")
+            return
+
+    headers = ALL_EXPECTED_HEADERS
+    required_headers = None
+    if test_config:
+        headers = BASE_HEADERS + test_config["result_headers"] + META_HEADERS
+        required_headers = test_config["result_headers"]
+
+    try:
+        export_path = await export_builder.build(
+            export_format, headers=headers, required_headers=required_headers,
+            date_from=dates[0] if dates else None, date_to=dates[1] if len(dates) > 1 else None,
+        )
+        with outbound_priority(PRIORITY_BULK):
+            await message.reply_document(
+                FSInputFile(export_path, filename=f"user_data.{export_format}"), caption="Данные пользователей.")
+    except Exception as e:
+        logger.error("Error exporting results (%s): %s", export_format, e)
+        await message.answer("Не удалось отправить файл. Попробуйте позже.")
 
 
 @dp.message(Command("restart"))
 async def command_restart_bot_session_handler(message: Message, state: FSMContext):
+    test_runs.cancel(state.key)
     current_fsm_state_str = await state.get_state()
     active_test_key = None
     if current_fsm_state_str:
@@ -1206,20 +1366,22 @@ async def command_restart_bot_session_handler(message: Message, state: FSMContex
             if current_fsm_state_str.startswith(config["fsm_group_class"].__name__):
                 active_test_key = test_key
                 break
+    cleanup = None
     if active_test_key and TEST_REGISTRY[active_test_key].get("cleanup_function"):
-        await TEST_REGISTRY[active_test_key]["cleanup_function"](state, bot,
-                                                                 final_text=f"Тест был остановлен командой /restart.")
+        cleanup = TEST_REGISTRY[active_test_key]["cleanup_function"](
+            state, bot, final_text=f"Тест был остановлен командой /restart.")
 
-    await state.clear()
-    await message.answer(
+    await concurrently(cleanup, message.answer(
         "Все текущие операции остановлены и ваш профиль сброшен.\n"
         "Используйте /start, чтобы начать заново (войти или зарегистрироваться)."
-    )
+    ))
+    await state.clear()
 
 
 @dp.callback_query(F.data == "logout_profile")
 async def logout_profile_callback(cb: CallbackQuery, state: FSMContext):
     await cb.answer("Профиль сброшен.", show_alert=True)
+    test_runs.cancel(state.key)
     await state.clear()
     try:
         await cb.message.edit_text(
@@ -1240,19 +1402,83 @@ async def logout_profile_callback(cb: CallbackQuery, state: FSMContext):
 
 
 # --- Main Bot Execution ---
-async def main():
-    initialize_excel_file()
-    logger.info("Bot starting...")
+async def on_startup():
+    await results_store.load()
+    await uid_allocator.load(results_store)
+    await results_store.start()
+    await metrics_exporter.start()
+
+
+async def on_shutdown():
+    await metrics_exporter.stop()
+    await outbound_scheduler.close()  # the bot session is closed after this
+    await results_store.close()
+    logger.info("Results store flushed on shutdown.")
+
+
+def setup_dispatcher():
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
 
     dp.callback_query.register(handle_corsi_button_press, F.data.startswith("corsi_button_"),
                                CorsiTestStates.waiting_for_user_sequence)
     dp.callback_query.register(on_corsi_restart_current_test, F.data == "corsi_stop_this_attempt",
                                StateFilter(CorsiTestStates))
 
-    dp.callback_query.register(handle_stroop_part1_response, F.data == "stroop_p1_next", StroopTestStates.part1_display)
+    dp.callback_query.register(handle_stroop_part_start, F.data == "stroop_start_part",
+                               StateFilter(*(display for display, _ in STROOP_PART_STATES.values())))
+    dp.callback_query.register(handle_stroop_answer, F.data.startswith("stroop_answer_"),
+                               StateFilter(*(response for _, response in STROOP_PART_STATES.values())))
+    dp.callback_query.register(on_stroop_stop, F.data == "stroop_stop_test", StateFilter(StroopTestStates))
+
+
+def setup_worker(index: int, worker_count: int):
+    """Called in each worker process (see workers.py) before it starts feeding updates."""
+    outbound_scheduler.set_global_rate(OUTBOUND_GLOBAL_RATE / worker_count)
+    uid_allocator.use_shard(index, worker_count)
+    if metrics_exporter.port:
+        metrics_exporter.port += index  # one /metrics endpoint per worker
+    setup_dispatcher()
+
+
+def webhook_options() -> dict:
+    return dict(
+        host=getattr(config, "WEBHOOK_HOST", "0.0.0.0"),
+        port=getattr(config, "WEBHOOK_PORT", 8080),
+        path=getattr(config, "WEBHOOK_PATH", WEBHOOK_PATH),
+        secret=getattr(config, "WEBHOOK_SECRET", None),
+        base_url=getattr(config, "WEBHOOK_BASE_URL", None),  # public https URL behind the reverse proxy
+    )
+
+
+async def run_sharded():
+    # Every worker has to see the same profiles, results and sessions.
+    if STORAGE_BACKEND != "sqlite" or FSM_STORAGE == "memory":
+        raise ValueError("WORKER_PROCESSES > 1 needs STORAGE_BACKEND = 'sqlite' and a shared FSM_STORAGE.")
+    router = ShardRouter(__name__, WORKER_PROCESSES)
+    router.start()
+    try:
+        if RUN_MODE == "webhook":
+            await router.serve_webhook(bot, allowed_updates=dp.resolve_used_update_types(), **webhook_options())
+        else:
+            await router.poll(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await asyncio.to_thread(router.stop)
+        await bot.session.close()
+
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+async def main():
+    logger.info("Bot starting...")
+    if WORKER_PROCESSES > 1:
+        await run_sharded()
+        return
+
+    setup_dispatcher()
+    if RUN_MODE == "webhook":
+        await run_webhook(dp, bot, **webhook_options())
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot)
 
 
 if __name__ == '__main__':
@@ -1261,4 +1487,4 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         logging.info('Bot stopped by user.')
     except Exception as e:
-        logging.error(f"Unhandled main exception: {e}", exc_info=True)
+        logging.error("Unhandled main exception: %s", e, exc_info=True)
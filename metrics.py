@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = "/metrics"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_string(labelnames: tuple, labels: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}  # label values tuple -> count
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_string(self.labelnames, labels)} {value}"
+                  for labels, value in sorted(self.values.items())]
+        return lines
+
+
+class Histogram:
+    """Prometheus histogram; also keeps the max per label set for the log summary."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {}  # label values tuple -> [bucket counts..., count, sum, max]
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * len(self.buckets) + [0, 0.0, 0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-3] += 1
+        series[-2] += value
+        series[-1] = max(series[-1], value)
+
+    def totals(self) -> dict:
+        """label values -> (count, sum, max)."""
+        return {labels: tuple(series[-3:]) for labels, series in self.series.items()}
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_string(self.labelnames, labels, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_string(self.labelnames, labels, le)} {series[-3]}")
+            lines.append(f"{self.name}_count{_label_string(self.labelnames, labels)} {series[-3]}")
+            lines.append(f"{self.name}_sum{_label_string(self.labelnames, labels)} {series[-2]:.6f}")
+        return lines
+
+
+class BotMetrics:
+    """Everything /metrics exposes: handlers, Bot API calls, storage operations, running tests."""
+
+    def __init__(self):
+        self.handler_duration = Histogram("bot_handler_duration_seconds", "Time spent in update handlers.",
+                                          ("handler",))
+        self.handler_errors = Counter("bot_handler_errors_total", "Handlers that raised.", ("handler",))
+        self.api_duration = Histogram("bot_api_request_duration_seconds", "Bot API request latency.", ("method",))
+        self.api_errors = Counter("bot_api_errors_total", "Failed Bot API requests.", ("method", "error"))
+        self.storage_duration = Histogram("bot_storage_operation_duration_seconds",
+                                          "Results storage operations, on the storage thread.", ("operation",))
+        self.active_tests = lambda: {}  # set by the bot: test key -> running tests
+
+    def observe_storage(self, operation: str, seconds: float):
+        self.storage_duration.observe(seconds, operation)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.handler_duration, self.handler_errors, self.api_duration, self.api_errors,
+                       self.storage_duration):
+            lines += metric.render()
+        lines += ["# HELP bot_active_tests Tests currently running.", "# TYPE bot_active_tests gauge"]
+        lines += [f'bot_active_tests{{test="{test}"}} {count}' for test, count in sorted(self.active_tests().items())]
+        return "\n".join(lines) + "\n"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware: times every handler by its function name and counts the ones that raise."""
+
+    def __init__(self, metrics: BotMetrics):
+        self.metrics = metrics
+
+    async def __call__(
+            self,
+            handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+            event: Any,
+            data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.handler_errors.inc(name)
+            raise
+        finally:
+            self.metrics.handler_duration.observe(time.perf_counter() - started, name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Session middleware: latency and errors per Bot API method (register it innermost)."""
+
+    def __init__(self, metrics: BotMetrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            self.metrics.api_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.metrics.api_duration.observe(time.perf_counter() - started, name)
+
+
+class MetricsExporter:
+    """Serves /metrics on host:port (when a port is set) and logs a summary every `log_interval` seconds."""
+
+    def __init__(self, metrics: BotMetrics, host: str = "127.0.0.1", port: int | None = None,
+                 log_interval: float = 300.0):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.log_interval = log_interval
+        self._runner = None
+        self._log_task = None
+        self._last_totals = {}
+
+    async def _serve_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Prometheus-Format": "0.0.4"})
+
+    async def start(self):
+        if self.port:
+            app = web.Application()
+            app.router.add_get(METRICS_PATH, self._serve_metrics)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            logger.info("Metrics on http://%s:%s%s", self.host, self.port, METRICS_PATH)
+        if self.log_interval:
+            self._log_task = asyncio.create_task(self._log_loop())
+
+    async def stop(self):
+        if self._log_task is not None:
+            self._log_task.cancel()
+            self._log_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _interval_summary(self, key: str, histogram: Histogram, top: int = 5) -> str:
+        last = self._last_totals.get(key, {})
+        totals = histogram.totals()
+        self._last_totals[key] = totals
+        parts = []
+        for labels, (count, total, _) in totals.items():
+            previous_count, previous_total, _ = last.get(labels, (0, 0.0, 0.0))
+            if count > previous_count:
+                parts.append((count - previous_count, (total - previous_total) / (count - previous_count), labels))
+        parts.sort(reverse=True)
+        return ", ".join(f"{'/'.join(map(str, labels))} {count}x avg {avg * 1000:.0f}ms"
+                         for count, avg, labels in parts[:top]) or "-"
+
+    def summary(self) -> str:
+        api_errors = sum(self.metrics.api_errors.values.values())
+        active = ", ".join(f"{test}={count}" for test, count in sorted(self.metrics.active_tests().items()))
+        return (f"handlers: {self._interval_summary('handlers', self.metrics.handler_duration)} | "
+                f"api: {self._interval_summary('api', self.metrics.api_duration)} (errors total {api_errors}) | "
+                f"storage: {self._interval_summary('storage', self.metrics.storage_duration)} | "
+                f"active tests: {active or '-'}")
+
+    async def _log_loop(self):
+        while True:
+            await asyncio.sleep(self.log_interval)
+            logger.info("Metrics for the last %.0fs: %s", self.log_interval, self.summary())
@@ -0,0 +1,273 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import DeleteMessage, DeleteMessages, EditMessageReplyMarkup, EditMessageText, SendMessage
+from aiogram.types import Message
+
+from keyboards import prepared_payload
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first when the rate limits are saturated.
+PRIORITY_TIMING = 0  # stimulus edits whose timing is part of a test (Corsi flashes)
+PRIORITY_INTERACTIVE = 1  # direct replies to what the user just did (default)
+PRIORITY_BULK = 2  # menus, result summaries, exports
+
+_outbound_priority = contextvars.ContextVar("outbound_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def outbound_priority(priority: int):
+    """Sets the lane for Bot API calls made inside the block (by this task)."""
+    token = _outbound_priority.set(priority)
+    try:
+        yield
+    finally:
+        _outbound_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Bot session middleware that paces every Bot API call.
+
+    Each call waits for a token from the global bucket and from its chat's bucket.
+    A bucket allows at most `burst + rate` calls in any one second, so the defaults
+    stay within Telegram's 30/s overall and the 5/s per chat the fake server enforces.
+    Waiting calls are granted in priority order (see `outbound_priority`), so when
+    the bot is saturated the Corsi flashes go out ahead of menus and summaries, and
+    a busy chat never holds up calls for other chats. Every `priority_aging` seconds
+    of waiting moves a call up one lane, so lower lanes still get their turn. A
+    TelegramRetryAfter blocks the offending chat (or everything, for calls without a
+    chat) for the requested time and the call is retried instead of failing the handler.
+    """
+
+    def __init__(self, global_rate: float = 29.0, global_burst: float = 1.0, chat_rate: float = 4.0,
+                 chat_burst: float = 1.0, priority_aging: float = 1.0, max_retries: int = 3):
+        self.global_burst = global_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.priority_aging = priority_aging
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._waiters = []  # (priority, seq, chat_id, future, queued at)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher_task = None
+
+    def set_global_rate(self, rate: float):
+        """Used by worker processes, which each get a share of the bot-wide limit."""
+        self.global_bucket = TokenBucket(rate, self.global_burst)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id, priority: int):
+        if self._dispatcher_task is None or self._dispatcher_task.done():
+            self._dispatcher_task = asyncio.create_task(self._dispatch_loop())
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((priority, next(self._seq), chat_id, future, time.monotonic()))
+        self._wakeup.set()
+        await future
+
+    def _grant_ready(self) -> float | None:
+        """Grants every waiter that can go now; returns how long until the next one might."""
+        now = time.monotonic()
+        next_delay = None
+        still_waiting = []
+        for entry in sorted(self._waiters, key=lambda entry: (
+                entry[0] - (now - entry[4]) / self.priority_aging if self.priority_aging else entry[0], entry[1])):
+            _, _, chat_id, future, _ = entry
+            if future.done():  # caller was cancelled while queued
+                continue
+            delay = self.global_bucket.delay(now)
+            if delay == 0 and chat_id is not None:
+                delay = self._chat_bucket(chat_id).delay(now)
+            if delay > 0:
+                still_waiting.append(entry)
+                next_delay = delay if next_delay is None else min(next_delay, delay)
+                continue
+            self.global_bucket.consume()
+            if chat_id is not None:
+                self._chat_bucket(chat_id).consume()
+            future.set_result(None)
+        self._waiters = still_waiting
+        return next_delay
+
+    async def _dispatch_loop(self):
+        last_prune = time.monotonic()
+        while True:
+            self._wakeup.clear()
+            next_delay = self._grant_ready()
+            if time.monotonic() - last_prune > 60:
+                self._prune_idle_chats()
+                last_prune = time.monotonic()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self, timeout: float = 5.0):
+        """Lets the calls already queued go out (for up to `timeout` seconds), then stops the dispatch loop."""
+        task = self._dispatcher_task
+        if task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while any(not entry[3].done() for entry in self._waiters) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        self._dispatcher_task = None
+        for entry in self._waiters:
+            if not entry[3].done():
+                entry[3].cancel()
+        self._waiters = []
+
+    def _prune_idle_chats(self):
+        now = time.monotonic()
+        waiting_chats = {entry[2] for entry in self._waiters}
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if chat_id not in waiting_chats and bucket.delay(now) == 0 and bucket.tokens >= bucket.capacity:
+                del self._chat_buckets[chat_id]
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        priority = _outbound_priority.get()
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.block(e.retry_after)
+                self._wakeup.set()
+                if attempt > self.max_retries:
+                    raise
+                logger.warning("Flood control on %s (chat %s): retrying in %ss (attempt %s/%s).",
+                               type(method).__name__, chat_id, e.retry_after, attempt, self.max_retries)
+
+
+def _markup_hash(markup) -> int:
+    if markup is None:
+        return hash(None)
+    payload = prepared_payload(markup)
+    return hash(payload if payload is not None else markup.model_dump_json(exclude_none=True))
+
+
+def _text_hash(method) -> int:
+    return hash((method.text, str(method.parse_mode), repr(method.entities)))
+
+
+class EditDeduplicator(BaseRequestMiddleware):
+    """Bot session middleware that skips edits which would not change the message.
+
+    Remembers a hash of the text and of the keyboard of the last `max_messages`
+    messages the bot sent or edited. An edit that matches what is already on screen
+    returns True without a request, and a "message is not modified" reply is treated
+    as success, so callers no longer see it as a failed edit. Either way the caller
+    gets True rather than a Message: code that needs the edited message's id must fall
+    back to the id it already has. While an edit of a
+    message is in flight nothing is known to be on screen, so no edit of it is skipped;
+    only the last edit sent records what the message shows.
+    """
+
+    def __init__(self, max_messages: int = 10000):
+        self.max_messages = max_messages
+        self._content = OrderedDict()  # (chat_id, message_id) -> [text hash, markup hash]
+        self._in_flight = {}  # (chat_id, message_id) -> [edits being sent, number of the latest one]
+
+    def _remember(self, key, text_hash=None, markup_hash=None):
+        content = self._content.pop(key, [None, None])
+        if text_hash is not None:
+            content[0] = text_hash
+        if markup_hash is not None:
+            content[1] = markup_hash
+        self._content[key] = content
+        if len(self._content) > self.max_messages:
+            self._content.popitem(last=False)
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, DeleteMessage):
+            self._content.pop((method.chat_id, method.message_id), None)
+        elif isinstance(method, DeleteMessages):
+            for message_id in method.message_ids:
+                self._content.pop((method.chat_id, message_id), None)
+        if not isinstance(method, (SendMessage, EditMessageText, EditMessageReplyMarkup)) or \
+                getattr(method, "inline_message_id", None):
+            return await make_request(bot, method)
+
+        text_hash = _text_hash(method) if not isinstance(method, EditMessageReplyMarkup) else None
+        markup_hash = _markup_hash(method.reply_markup)
+        if isinstance(method, SendMessage):
+            result = await make_request(bot, method)
+            if isinstance(result, Message):
+                self._remember((result.chat.id, result.message_id), text_hash, markup_hash)
+            return result
+
+        key = (method.chat_id, method.message_id)
+        in_flight = self._in_flight.get(key)
+        if in_flight is None:
+            known = self._content.get(key)
+            if known and (text_hash is None or known[0] == text_hash) and known[1] == markup_hash:
+                return True
+            in_flight = self._in_flight[key] = [0, 0]
+        in_flight[0] += 1
+        in_flight[1] += 1
+        number = in_flight[1]
+        try:
+            result = await make_request(bot, method)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in e.message:
+                self._content.pop(key, None)
+                raise
+            result = True
+        finally:
+            in_flight[0] -= 1
+            if not in_flight[0]:
+                del self._in_flight[key]
+        if number == in_flight[1]:
+            self._remember(key, text_hash, markup_hash)
+        return result
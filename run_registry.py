@@ -0,0 +1,78 @@
+import logging
+from collections import Counter
+
+from timing import TimedPlan
+
+logger = logging.getLogger(__name__)
+
+
+class TestRun:
+    """A user's running test and the timed plan it has on screen.
+
+    Cancelling the run cancels the plan directly, so nothing the test scheduled can
+    touch the chat or the storage after /stoptest, /restart or a logout.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.cancelled = False
+        self.plan = None
+
+    def run_plan(self, plan: TimedPlan):
+        if self.plan is not None:
+            self.plan.cancel()
+        self.plan = plan
+        if self.cancelled:
+            plan.cancel()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.plan is not None:
+            self.plan.cancel()
+
+
+class TestRunRegistry:
+    """FSM key -> the TestRun currently owning that user's test."""
+
+    def __init__(self):
+        self._runs = {}
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def counts(self) -> Counter:
+        """Running tests per test name."""
+        return Counter(run.name for run in self._runs.values() if not run.cancelled)
+
+    def start(self, key, name: str) -> TestRun:
+        self.cancel(key)
+        run = self._runs[key] = TestRun(name)
+        return run
+
+    def get(self, key) -> TestRun | None:
+        return self._runs.get(key)
+
+    def resume(self, key, name: str) -> TestRun:
+        """The run of a test the FSM says is in progress; a new one if the bot restarted since it started.
+
+        Runs live only in memory while FSM state survives restarts. Stopping a test
+        clears its FSM state too, so a handler that still sees the test state found
+        no run because of a restart, not because the test was stopped.
+        """
+        run = self._runs.get(key)
+        if run is None:
+            run = self._runs[key] = TestRun(name)
+            logger.info("Resumed %s test for %s after a restart.", name, key.chat_id)
+        return run
+
+    def is_active(self, key, run: TestRun | None = None) -> bool:
+        current = self._runs.get(key)
+        return current is not None and not current.cancelled and (run is None or current is run)
+
+    def cancel(self, key) -> bool:
+        run = self._runs.pop(key, None)
+        if run is None:
+            return False
+        run.cancel()
+        logger.info("Cancelled running %s test for %s.", run.name, key.chat_id)
+        return True
@@ -0,0 +1,24 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+
+async def concurrently(*calls: Awaitable | None) -> list:
+    """Awaits independent calls (API requests, or `in_order` chains of them) at the same time.
+
+    The calls start in argument order, so whatever each one does before its first real
+    await happens in that order too. None entries are skipped, for calls that are only
+    sometimes needed. Every call is allowed to finish; the first exception is raised after.
+    """
+    results = await asyncio.gather(*(call for call in calls if call is not None), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def in_order(*steps: Callable[[], Awaitable[Any]] | None) -> list:
+    """Runs `step()` for each step after the previous one finished: for calls whose order the user
+    sees, e.g. a test summary that has to appear above the menu sent after it.
+    """
+    return [await step() for step in steps if step is not None]
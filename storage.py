@@ -0,0 +1,749 @@
+import asyncio
+import datetime
+import functools
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+logger = logging.getLogger(__name__)
+
+EXCEL_FILENAME = "persistent_user_data.xlsx"
+SQLITE_FILENAME = "persistent_user_data.sqlite3"
+
+BASE_HEADERS = ["Telegram ID", "Unique ID", "Name", "Age"]
+CORSI_HEADERS = [
+    "Corsi - Max Correct Sequence Length",
+    "Corsi - Avg Time Per Element (s)",
+    "Corsi - Sequence Times Detail",
+    "Corsi - Interrupted",
+    "Corsi - Tap Times (ms)",
+    "Corsi - Latency Report",
+]
+STROOP_HEADERS = [
+    "Stroop Part1 Time (s)", "Stroop Part1 Errors",
+    "Stroop Part2 Time (s)", "Stroop Part2 Errors",
+    "Stroop Part3 Time (s)", "Stroop Part3 Errors",
+    "Stroop - Interrupted",
+]
+META_HEADERS = ["Last Updated"]
+ALL_EXPECTED_HEADERS = BASE_HEADERS + CORSI_HEADERS + STROOP_HEADERS + META_HEADERS
+
+# A test counts as taken when any of its columns here has a value; each test is one bit of the results bitmap.
+RESULT_GROUPS = {
+    "corsi": ["Corsi - Max Correct Sequence Length", "Corsi - Avg Time Per Element (s)",
+              "Corsi - Sequence Times Detail"],
+    "stroop": ["Stroop Part1 Time (s)", "Stroop Part1 Errors"],
+}
+RESULT_BITS = {group: 1 << i for i, group in enumerate(RESULT_GROUPS)}
+
+
+def _timestamp() -> str:
+    return datetime.datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+def result_mask(row: dict | None) -> int:
+    if not row:
+        return 0
+    mask = 0
+    for group, headers in RESULT_GROUPS.items():
+        if any(row.get(header) is not None for header in headers):
+            mask |= RESULT_BITS[group]
+    return mask
+
+
+class _PendingWrite:
+    """A queued mutation and the callers waiting for it; updates to one UID are merged while queued."""
+
+    def __init__(self, kind: str, unique_id, args: tuple):
+        self.kind = kind
+        self.unique_id = unique_id
+        self.args = args
+        self.futures = []
+
+
+class ResultsRepository(ABC):
+    """The participant profile/results operations the bot performs, independent of storage.
+
+    Rows are exchanged as dicts keyed by the sheet headers in ALL_EXPECTED_HEADERS.
+    Every backend call runs on a single dedicated storage thread, so the public
+    coroutines never block the event loop and backends need no locking.
+
+    Mutations go through a single-writer queue: whatever piles up while a batch is
+    being written is applied next as one batch (one journal fsync or one SQLite
+    transaction), and queued result updates for the same UID collapse into one.
+    """
+
+    def __init__(self):
+        self.version = 0  # bumped after every write batch; lets exports know when a snapshot is stale
+        self._completed_tests = {}  # Unique ID -> result_mask of the stored row, rebuilt on load
+        self._loop = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="results-storage")
+        self._pending_writes = []
+        self._pending_updates = {}  # Unique ID -> its queued "update" entry in self._pending_writes
+        self._writer_task = None
+        self.operation_observer = None  # optional callable(operation name, seconds on the storage thread)
+
+    async def _run(self, func, *args):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args)
+        if self.operation_observer is not None:
+            call = functools.partial(self._observed, func.__name__.lstrip("_"), call)
+        return await self._loop.run_in_executor(self._executor, call)
+
+    def _observed(self, operation: str, call):
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            self.operation_observer(operation, time.perf_counter() - started)
+
+    # --- Lifecycle ---
+    async def load(self):
+        await self._run(self._load)
+        await self._run(self._rebuild_completed_tests)
+
+    async def start(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        await self.wait_for_writes()
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    # --- Queries ---
+    async def find_by_uid(self, unique_id) -> dict | None:
+        return await self._run(self._find_by_uid, unique_id)
+
+    async def uid_exists(self, unique_id) -> bool:
+        return await self._run(self._uid_exists, unique_id)
+
+    async def count_unique_ids(self) -> int:
+        return await self._run(self._count_unique_ids)
+
+    async def find_uids_by_telegram_id(self, telegram_id) -> list:
+        return await self._run(self._find_uids_by_telegram_id, telegram_id)
+
+    async def completed_tests(self, unique_id) -> int:
+        """Bitmask of the RESULT_BITS of every test with saved results for `unique_id`."""
+        return await self._run(self._completed_tests_for, unique_id)
+
+    async def snapshot_version(self):
+        """Changes whenever the stored rows may have changed, including writes by other processes."""
+        return self.version
+
+    async def dump_all(self) -> list:
+        return await self._run(self._dump_all)
+
+    async def stream_rows(self, consumer):
+        """Runs `consumer(rows)` on the storage thread with a lazy iterator over all rows."""
+        return await self._run(self._stream_rows, consumer)
+
+    def _dump_all(self) -> list:
+        return list(self._iter_rows())
+
+    def _stream_rows(self, consumer):
+        return consumer(self._iter_rows())
+
+    # --- Mutations ---
+    async def create_profile(self, telegram_id, unique_id, name, age):
+        await self._queue_write("create", unique_id, (telegram_id, unique_id, name, age))
+
+    async def update_results(self, unique_id, values: dict, profile: dict):
+        """Upserts result columns for `unique_id`, creating the row from `profile` if it is missing."""
+        await self._queue_write("update", unique_id, (dict(values, **{"Last Updated": _timestamp()}), profile))
+
+    async def wait_for_writes(self):
+        if self._writer_task is not None:
+            await asyncio.shield(self._writer_task)
+
+    # --- Write queue ---
+    def _queue_write(self, kind: str, unique_id, args: tuple) -> asyncio.Future:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        write = self._pending_updates.get(unique_id) if kind == "update" else None
+        if write is not None:
+            values, profile = write.args
+            # Later values win; the first profile is kept, as it is only used if the row is missing.
+            write.args = (dict(values, **args[0]), profile)
+        else:
+            write = _PendingWrite(kind, unique_id, args)
+            self._pending_writes.append(write)
+            if kind == "update":
+                self._pending_updates[unique_id] = write
+        future = self._loop.create_future()
+        write.futures.append(future)
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = self._loop.create_task(self._drain_writes())
+        # Shielded: a caller giving up (e.g. a cancelled test) must not take its write with it.
+        return asyncio.shield(future)
+
+    async def _drain_writes(self):
+        while self._pending_writes:
+            batch, self._pending_writes = self._pending_writes, []
+            self._pending_updates = {}
+            try:
+                errors = await self._run(self._apply_writes, batch)
+            except Exception as e:
+                errors = [e] * len(batch)
+            self.version += 1
+            for write, error in zip(batch, errors):
+                for future in write.futures:
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+            if len(batch) > 1:
+                logger.debug("Applied %s queued writes as one batch.", len(batch))
+
+    def _apply_writes(self, batch: list) -> list:
+        errors = []
+        with self._write_batch():
+            for write in batch:
+                try:
+                    if write.kind == "create":
+                        self._create_profile(*write.args)
+                    else:
+                        self._update_and_index(write.unique_id, *write.args)
+                    errors.append(None)
+                except Exception as e:
+                    errors.append(e)
+        return errors
+
+    # --- Results bitmap, on the storage thread ---
+    def _rebuild_completed_tests(self):
+        self._completed_tests = {}
+        for row in self._iter_rows():
+            # setdefault: the first row of a duplicated UID is the one _find_by_uid returns
+            self._completed_tests.setdefault(row.get("Unique ID"), result_mask(row))
+
+    def _completed_tests_for(self, unique_id) -> int:
+        mask = self._completed_tests.get(unique_id)
+        if mask is None:
+            mask = self._completed_tests[unique_id] = result_mask(self._find_by_uid(unique_id))
+        return mask
+
+    def _update_and_index(self, unique_id, values: dict, profile: dict):
+        self._update_results(unique_id, values, profile)
+        self._completed_tests[unique_id] = result_mask(self._find_by_uid(unique_id))
+
+    # --- Backend hooks, always called on the storage thread ---
+    @abstractmethod
+    def _load(self):
+        ...
+
+    def _close(self):
+        pass
+
+    @contextmanager
+    def _write_batch(self):
+        """Wraps one batch of mutations; backends make it durable once, on exit."""
+        yield
+
+    @abstractmethod
+    def _find_by_uid(self, unique_id) -> dict | None:
+        ...
+
+    @abstractmethod
+    def _uid_exists(self, unique_id) -> bool:
+        ...
+
+    @abstractmethod
+    def _count_unique_ids(self) -> int:
+        ...
+
+    @abstractmethod
+    def _find_uids_by_telegram_id(self, telegram_id) -> list:
+        ...
+
+    @abstractmethod
+    def _iter_rows(self):
+        ...
+
+    @abstractmethod
+    def _create_profile(self, telegram_id, unique_id, name, age):
+        ...
+
+    @abstractmethod
+    def _update_results(self, unique_id, values: dict, profile: dict):
+        ...
+
+
+class ExcelResultsRepository(ResultsRepository):
+    """Process-wide copy of the participants sheet, served from memory.
+
+    The workbook is parsed once by `load()`. Mutations only touch the in-memory
+    rows and mark them dirty; dirty rows are written back to the xlsx by a
+    background task every `flush_interval` seconds, as soon as
+    `flush_batch_size` rows are pending, and once more on `close()`. A flush only
+    copies the dirty rows on the storage thread; the workbook belongs to a
+    separate save thread, so the multi-second xlsx save never delays queries.
+
+    Because the expensive xlsx rewrite is batched, every mutation is first
+    appended (and fsynced) to a newline-delimited JSON journal next to the
+    workbook. `load()` replays whatever the journal holds on top of the last
+    saved workbook, and each successful flush empties it. The workbook itself is
+    saved to a temp file and atomically renamed over the old copy, so a crash
+    mid-save leaves the previous version intact. Mutations journaled while a save
+    is running stay in the journal for the next one.
+    """
+
+    def __init__(self, filename: str = EXCEL_FILENAME, flush_interval: float = 5.0, flush_batch_size: int = 25):
+        super().__init__()
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self._wb = None
+        self._ws = None
+        self._columns = {}  # header -> 1-based column index in the sheet
+        self._rows = []  # row values keyed by header; self._rows[i] lives on sheet row i + 2
+        self._row_by_uid = {}  # Unique ID -> index into self._rows
+        self._uids_by_telegram_id = {}  # Telegram ID -> [Unique ID, ...] in registration order
+        self._dirty_rows = set()
+        self._flush_requested = asyncio.Event()
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        # Owns self._wb/self._ws after load(): cells are only written and saved there.
+        self._save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="results-save")
+        self.journal_filename = f"{filename}.journal"
+        self._journal = None
+        self._journal_batched = False
+
+    def _save_workbook(self):
+        tmp_filename = f"{self.filename}.tmp"
+        self._wb.save(tmp_filename)
+        with open(tmp_filename, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+        if os.name == "posix":
+            # Persist the rename itself; directories can't be opened for fsync on Windows.
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.filename)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    # --- Journal ---
+    def _journal_append(self, entry: dict):
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        if not self._journal_batched:
+            self._journal_sync()
+
+    def _journal_sync(self):
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    @contextmanager
+    def _write_batch(self):
+        # One fsync for the whole batch; no caller is answered before it completes.
+        self._journal_batched = True
+        try:
+            yield
+        finally:
+            self._journal_batched = False
+            self._journal_sync()
+
+    def _journal_offset(self) -> int:
+        self._journal_sync()
+        return os.fstat(self._journal.fileno()).st_size
+
+    def _journal_drop(self, offset: int):
+        """Removes the entries before `offset`, which a finished save has made redundant."""
+        if self._journal_offset() == offset:
+            self._journal.seek(0)
+            self._journal.truncate()
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            return
+        # Entries appended during the save are kept: write them to a new journal and swap it in.
+        self._journal.close()
+        tmp_filename = f"{self.journal_filename}.tmp"
+        with open(self.journal_filename, "rb") as src, open(tmp_filename, "wb") as dst:
+            src.seek(offset)
+            dst.write(src.read())
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_filename, self.journal_filename)
+        self._journal = open(self.journal_filename, "a", encoding="utf-8")
+
+    def _replay_journal(self) -> int:
+        if not os.path.exists(self.journal_filename):
+            return 0
+        replayed = 0
+        with open(self.journal_filename, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last line can be torn by a crash mid-append; it was never acknowledged.
+                    logger.warning("Ignoring unreadable entry at line %s of '%s'.", line_number, self.journal_filename)
+                    break
+                if entry["op"] == "create":
+                    self._apply_create(entry["row"])
+                elif entry["op"] == "update":
+                    self._apply_update(entry["unique_id"], entry["values"], entry["profile"])
+                replayed += 1
+        return replayed
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            self._wb = Workbook()
+            self._ws = self._wb.active
+            self._ws.append(ALL_EXPECTED_HEADERS)
+            self._save_workbook()
+            logger.info("'%s' created with all headers.", self.filename)
+        else:
+            try:
+                self._wb = load_workbook(self.filename)
+                self._ws = self._wb.active
+                if self._ws.max_row == 0:
+                    self._ws.append(ALL_EXPECTED_HEADERS)
+                    logger.info("Appended all headers to empty sheet in '%s'.", self.filename)
+                else:
+                    current_headers = [cell.value for cell in self._ws[1]]
+                    new_headers_to_add = [h for h in ALL_EXPECTED_HEADERS if h not in current_headers]
+                    if new_headers_to_add:
+                        header_col_start_index = len(current_headers) + 1
+                        for i, header in enumerate(new_headers_to_add):
+                            self._ws.cell(row=1, column=header_col_start_index + i).value = header
+                        logger.info("Added missing headers to '%s': %s", self.filename, new_headers_to_add)
+                self._save_workbook()
+                logger.info("'%s' checked/updated for headers.", self.filename)
+            except (InvalidFileException, Exception) as e:
+                logger.error(
+                    "Error initializing/updating Excel file '%s': %s. Manual check might be needed.", self.filename, e)
+                raise
+
+        self._columns = {cell.value: cell.column for cell in self._ws[1] if cell.value is not None}
+        self._rows = []
+        self._row_by_uid = {}
+        self._uids_by_telegram_id = {}
+        for row_values in self._ws.iter_rows(min_row=2, values_only=True):
+            self._rows.append({
+                header: row_values[col - 1] if col - 1 < len(row_values) else None
+                for header, col in self._columns.items()
+            })
+            self._index_row(len(self._rows) - 1)
+        self._dirty_rows.clear()
+        logger.info("Loaded %s participant rows from '%s' into memory.", len(self._rows), self.filename)
+
+        replayed = self._replay_journal()
+        self._journal = open(self.journal_filename, "a", encoding="utf-8")
+        if replayed:
+            logger.warning("Replayed %s unsaved mutations from '%s'.", replayed, self.journal_filename)
+            snapshot = self._snapshot_dirty()
+            self._save_rows(snapshot[0])
+            self._journal_drop(snapshot[1])
+
+    def _close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._save_executor.shutdown(wait=True)
+
+    async def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._write_behind_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.wait_for_writes()
+        await self.flush()
+        await super().close()
+
+    async def _write_behind_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Write-behind flush to '%s' failed, will retry: %s", self.filename, e)
+
+    async def flush(self):
+        async with self._flush_lock:
+            rows, journal_offset = await self._run(self._snapshot_dirty)
+            if not rows:
+                return
+            call = functools.partial(self._save_rows, rows)
+            if self.operation_observer is not None:
+                call = functools.partial(self._observed, "save_rows", call)
+            try:
+                await self._loop.run_in_executor(self._save_executor, call)
+            except Exception:
+                await self._run(self._restore_dirty, [row_index for row_index, _ in rows])
+                raise
+            await self._run(self._journal_drop, journal_offset)
+            logger.info("Flushed %s dirty rows to '%s'.", len(rows), self.filename)
+
+    def _snapshot_dirty(self) -> tuple:
+        """Copies the dirty rows and marks the journal: everything before the mark is in the copy."""
+        rows = [(row_index, dict(self._rows[row_index])) for row_index in sorted(self._dirty_rows)]
+        self._dirty_rows.clear()
+        return rows, self._journal_offset()
+
+    def _restore_dirty(self, row_indexes: list):
+        self._dirty_rows.update(row_indexes)
+
+    def _save_rows(self, rows: list):
+        """Writes copied rows into the workbook and saves it; runs on the save thread."""
+        for row_index, row_values in rows:
+            for header, col in self._columns.items():
+                self._ws.cell(row=row_index + 2, column=col).value = row_values.get(header)
+        self._save_workbook()
+
+    def _mark_dirty(self, row_index: int):
+        self._dirty_rows.add(row_index)
+        if len(self._dirty_rows) >= self.flush_batch_size and self._loop is not None:
+            # Runs on the storage thread; asyncio.Event is not thread-safe.
+            self._loop.call_soon_threadsafe(self._flush_requested.set)
+
+    # --- Indexes ---
+    def _index_row(self, row_index: int):
+        row_values = self._rows[row_index]
+        unique_id = row_values.get("Unique ID")
+        if unique_id is None:
+            return
+        # Like the old top-down sheet scan, the first row with a given UID wins.
+        if unique_id in self._row_by_uid:
+            logger.warning("Duplicate UID %s on sheet row %s; keeping the first occurrence.", unique_id, row_index + 2)
+            return
+        self._row_by_uid[unique_id] = row_index
+        telegram_id = row_values.get("Telegram ID")
+        if telegram_id is not None:
+            self._uids_by_telegram_id.setdefault(telegram_id, []).append(unique_id)
+
+    # --- Queries ---
+    def _find_row_index(self, unique_id) -> int | None:
+        return self._row_by_uid.get(unique_id)
+
+    def _uid_exists(self, unique_id) -> bool:
+        return unique_id in self._row_by_uid
+
+    def _count_unique_ids(self) -> int:
+        return len(self._row_by_uid)
+
+    def _find_uids_by_telegram_id(self, telegram_id) -> list:
+        return list(self._uids_by_telegram_id.get(telegram_id, []))
+
+    def _iter_rows(self):
+        for row_values in self._rows:
+            if row_values.get("Unique ID") is not None:
+                yield dict(row_values)
+
+    def _find_by_uid(self, unique_id) -> dict | None:
+        row_index = self._find_row_index(unique_id)
+        if row_index is None:
+            return None
+        return dict(self._rows[row_index])
+
+    # --- Mutations ---
+    def _append_row(self, profile: dict) -> int:
+        row_values = {header: None for header in self._columns}
+        row_values.update(profile)
+        self._rows.append(row_values)
+        row_index = len(self._rows) - 1
+        self._index_row(row_index)
+        self._mark_dirty(row_index)
+        return row_index
+
+    def _apply_create(self, row: dict):
+        if row.get("Unique ID") in self._row_by_uid:
+            return  # already flushed to the workbook before the journal was emptied
+        self._append_row(row)
+
+    def _apply_update(self, unique_id, values: dict, profile: dict):
+        row_index = self._find_row_index(unique_id)
+        if row_index is None:
+            logger.error(
+                "UID %s for test results not found in Excel. Appending profile data along with test results.",
+                unique_id)
+            row_index = self._append_row(dict(profile, **{"Unique ID": unique_id}))
+        self._rows[row_index].update(values)
+        self._mark_dirty(row_index)
+
+    def _create_profile(self, telegram_id, unique_id, name, age):
+        row = {
+            "Telegram ID": telegram_id, "Unique ID": unique_id, "Name": name, "Age": age,
+            "Last Updated": _timestamp(),
+        }
+        self._journal_append({"op": "create", "row": row})
+        self._apply_create(row)
+
+    def _update_results(self, unique_id, values: dict, profile: dict):
+        self._journal_append({"op": "update", "unique_id": unique_id, "values": values, "profile": profile})
+        self._apply_update(unique_id, values, profile)
+
+
+def _sql_column_name(header: str) -> str:
+    return re.sub(r"[^0-9a-z]+", "_", header.lower()).strip("_")
+
+
+SQL_COLUMNS = {header: _sql_column_name(header) for header in ALL_EXPECTED_HEADERS}
+
+
+class SqliteResultsRepository(ResultsRepository):
+    """Participants table in SQLite: WAL journal, unique index on the UID, one transaction per write batch."""
+
+    def __init__(self, filename: str = SQLITE_FILENAME, import_from_excel: str | None = EXCEL_FILENAME):
+        super().__init__()
+        self.filename = filename
+        self.import_from_excel = import_from_excel
+        self._conn = None
+        self._indexed_data_version = None
+
+    def _load(self):
+        self._conn = sqlite3.connect(self.filename)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS participants ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "unique_id INTEGER NOT NULL UNIQUE, "
+                "telegram_id INTEGER)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS participants_telegram_id ON participants (telegram_id)")
+            existing_columns = {row[1] for row in self._conn.execute("PRAGMA table_info(participants)")}
+            for column in SQL_COLUMNS.values():
+                if column not in existing_columns:
+                    # No declared type: values keep whatever type the bot stored, as in the sheet.
+                    self._conn.execute(f"ALTER TABLE participants ADD COLUMN {column}")
+        row_count = self._count_unique_ids()
+        if row_count == 0 and self.import_from_excel and os.path.exists(self.import_from_excel):
+            self._import_workbook(self.import_from_excel)
+            row_count = self._count_unique_ids()
+        logger.info("Opened SQLite results database '%s' with %s participants.", self.filename, row_count)
+
+    def _import_workbook(self, excel_filename: str):
+        wb = load_workbook(excel_filename, read_only=True)
+        ws = wb.active
+        rows = ws.iter_rows(values_only=True)
+        headers = next(rows, None) or ()
+        columns = [SQL_COLUMNS.get(header) for header in headers]
+        imported = 0
+        with self._conn:
+            for row in rows:
+                values = {column: value for column, value in zip(columns, row) if column}
+                if values.get("unique_id") is None:
+                    continue
+                names = ", ".join(values)
+                placeholders = ", ".join("?" for _ in values)
+                cursor = self._conn.execute(
+                    f"INSERT OR IGNORE INTO participants ({names}) VALUES ({placeholders})", list(values.values()))
+                imported += cursor.rowcount
+        wb.close()
+        logger.info("Imported %s participants from '%s' into '%s'.", imported, excel_filename, self.filename)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def snapshot_version(self):
+        # data_version moves when another connection (e.g. another bot worker process) commits.
+        data_version = await self._run(self._data_version)
+        return self.version, data_version
+
+    def _data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _row_to_dict(self, row) -> dict:
+        return {header: row[i] for i, header in enumerate(ALL_EXPECTED_HEADERS)}
+
+    def _select_sql(self) -> str:
+        return f"SELECT {', '.join(SQL_COLUMNS.values())} FROM participants"
+
+    def _find_by_uid(self, unique_id) -> dict | None:
+        row = self._conn.execute(f"{self._select_sql()} WHERE unique_id = ?", (unique_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def _uid_exists(self, unique_id) -> bool:
+        return self._conn.execute("SELECT 1 FROM participants WHERE unique_id = ?", (unique_id,)).fetchone() is not None
+
+    def _count_unique_ids(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM participants").fetchone()[0]
+
+    def _find_uids_by_telegram_id(self, telegram_id) -> list:
+        cursor = self._conn.execute("SELECT unique_id FROM participants WHERE telegram_id = ? ORDER BY id", (telegram_id,))
+        return [row[0] for row in cursor]
+
+    def _rebuild_completed_tests(self):
+        self._indexed_data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        super()._rebuild_completed_tests()
+
+    def _completed_tests_for(self, unique_id) -> int:
+        # Another process (bot worker) may have saved results since the bitmap was built: start over lazily.
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._indexed_data_version:
+            self._completed_tests.clear()
+            self._indexed_data_version = data_version
+        return super()._completed_tests_for(unique_id)
+
+    def _iter_rows(self):
+        for row in self._conn.execute(f"{self._select_sql()} ORDER BY id"):
+            yield self._row_to_dict(row)
+
+    @contextmanager
+    def _write_batch(self):
+        # A failing statement (e.g. a duplicate UID) only undoes itself, not the rest of the batch.
+        with self._conn:
+            yield
+
+    def _create_profile(self, telegram_id, unique_id, name, age):
+        self._conn.execute(
+            f"INSERT INTO participants (telegram_id, unique_id, name, age, {SQL_COLUMNS['Last Updated']}) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (telegram_id, unique_id, name, age, _timestamp()),
+        )
+
+    def _update_results(self, unique_id, values: dict, profile: dict):
+        row = dict(profile, **values)
+        row["Unique ID"] = unique_id
+        columns = [SQL_COLUMNS[header] for header in row]
+        updates = ", ".join(f"{SQL_COLUMNS[header]} = excluded.{SQL_COLUMNS[header]}" for header in values)
+        self._conn.execute(
+            f"INSERT INTO participants ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(unique_id) DO UPDATE SET {updates}",
+            list(row.values()),
+        )
+
+
+def create_results_repository(backend: str = "excel", **options) -> ResultsRepository:
+    if backend == "excel":
+        return ExcelResultsRepository(
+            options.get("excel_filename", EXCEL_FILENAME),
+            flush_interval=options.get("flush_interval", 5.0),
+            flush_batch_size=options.get("flush_batch_size", 25),
+        )
+    if backend == "sqlite":
+        return SqliteResultsRepository(
+            options.get("sqlite_filename", SQLITE_FILENAME),
+            import_from_excel=options.get("excel_filename", EXCEL_FILENAME),
+        )
+    raise ValueError(f"Unknown results storage backend: {backend!r}")
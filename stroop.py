@@ -0,0 +1,96 @@
+import random
+
+# (answer button text, stimulus word, colour patch)
+STROOP_COLORS = (
+    ("Красный", "КРАСНЫЙ", "🟥"),
+    ("Синий", "СИНИЙ", "🟦"),
+    ("Зеленый", "ЗЕЛЕНЫЙ", "🟩"),
+    ("Желтый", "ЖЕЛТЫЙ", "🟨"),
+    ("Черный", "ЧЕРНЫЙ", "⬛"),
+)
+STROOP_PARTS = (1, 2, 3)
+
+STROOP_PART_INTROS = {
+    1: "Тест Струпа, часть 1 из 3.\nНа экране будет появляться название цвета. "
+       "Как можно быстрее нажимайте кнопку с этим же названием.",
+    2: "Часть 2 из 3.\nНа экране будут появляться цветные квадраты. "
+       "Как можно быстрее нажимайте кнопку с названием их цвета.",
+    3: "Часть 3 из 3.\nНа экране будет появляться название цвета между цветными квадратами. "
+       "Нажимайте кнопку с цветом <b>квадратов</b>, не обращая внимания на слово.",
+}
+STROOP_PART_PROMPTS = {1: "какое слово?", 2: "какой цвет?", 3: "какого цвета квадраты?"}
+
+
+# --- Decks ---
+# A trial is one int, word * len(STROOP_COLORS) + ink, so a whole session is three short
+# int lists in the FSM data. The correct answer is always the ink; parts 1 and 2 only show
+# one of the two (and have word == ink), part 3 shows the word in between patches of the ink.
+def stroop_trial_code(word: int, ink: int) -> int:
+    return word * len(STROOP_COLORS) + ink
+
+
+def stroop_word(code: int) -> int:
+    return code // len(STROOP_COLORS)
+
+
+def stroop_ink(code: int) -> int:
+    return code % len(STROOP_COLORS)
+
+
+def _can_follow(counts: list, previous: int) -> bool:
+    """Whether the inks left in `counts` can be ordered without repeats after `previous`."""
+    remaining = sum(counts)
+    return all(count <= (remaining + (ink != previous)) // 2 for ink, count in enumerate(counts))
+
+
+def generate_stroop_deck(part: int, trials: int, rng: random.Random = random) -> list:
+    """Balanced deck: every colour is the answer equally often and, where avoidable, never twice
+    in a row. In part 3 half of the trials are congruent and half incongruent.
+    """
+    n = len(STROOP_COLORS)
+    counts = [trials // n + (ink < trials % n) for ink in range(n)]
+    rng.shuffle(counts)  # which colours get the extra trial when `trials` is not a multiple of n
+    inks = []
+    for _ in range(trials):
+        # Each next ink is drawn from what is left, never the previous one unless there is no other
+        # choice, and only if the rest can still be ordered without repeats: no dead ends late in the deck.
+        previous = inks[-1] if inks else None
+        candidates = [ink for ink, count in enumerate(counts) if count and ink != previous]
+        safe = [ink for ink in candidates if _can_follow(counts[:ink] + [counts[ink] - 1] + counts[ink + 1:], ink)]
+        ink = rng.choice(safe or candidates or [previous])
+        counts[ink] -= 1
+        inks.append(ink)
+    if part != 3:
+        return [stroop_trial_code(ink, ink) for ink in inks]
+    congruent = [k < trials // 2 for k in range(trials)]
+    rng.shuffle(congruent)
+    return [stroop_trial_code(ink if same else (ink + 1 + rng.randrange(n - 1)) % n, ink)
+            for ink, same in zip(inks, congruent)]
+
+
+# --- Stimuli ---
+def _render_stimulus(part: int, code: int) -> str:
+    word, patch = STROOP_COLORS[stroop_word(code)][1], STROOP_COLORS[stroop_ink(code)][2]
+    if part == 1:
+        return f"<b>{word}</b>"
+    if part == 2:
+        return patch * 3
+    return f"{patch}{patch} <b>{word}</b> {patch}{patch}"
+
+
+# Every stimulus the test can show, rendered once: (part, trial code) -> HTML text.
+STROOP_STIMULI = {
+    (part, code): _render_stimulus(part, code)
+    for part in STROOP_PARTS for code in range(len(STROOP_COLORS) ** 2)
+}
+
+
+def stroop_trial_text(part: int, deck: list, trial: int) -> str:
+    # The trial counter also keeps two equal stimuli in a row from being a no-op edit.
+    return (f"Часть {part}/{len(STROOP_PARTS)} · {trial + 1}/{len(deck)} — {STROOP_PART_PROMPTS[part]}\n\n"
+            f"{STROOP_STIMULI[part, deck[trial]]}")
+
+
+def stroop_part_time(trial_times_ms: list) -> float:
+    """Part score in seconds: the sum of the per-trial reaction times."""
+    return round(sum(trial_times_ms) / 1000, 2)
@@ -0,0 +1,69 @@
+import asyncio
+
+from aiogram.methods import EditMessageReplyMarkup
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from outbound import EditDeduplicator
+
+BASE = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬜", callback_data="cell")]])
+LIT = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🟦", callback_data="cell")]])
+
+
+def _edit(markup: InlineKeyboardMarkup) -> EditMessageReplyMarkup:
+    return EditMessageReplyMarkup(chat_id=1, message_id=10, reply_markup=markup)
+
+
+class SlowApi:
+    """Records the markups it is asked to show; every request takes `latency` seconds."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = []
+
+    async def __call__(self, bot, method):
+        self.sent.append(method.reply_markup)
+        await asyncio.sleep(self.latency)
+        return True
+
+
+def test_repeated_edit_is_skipped():
+    async def run():
+        dedup, api = EditDeduplicator(), SlowApi()
+        await dedup(api, None, _edit(LIT))
+        await dedup(api, None, _edit(LIT))
+        return api.sent
+
+    assert asyncio.run(run()) == [LIT]
+
+
+def test_edit_overlapping_one_in_flight_is_sent():
+    # A flash-off issued while the flash-on is still in flight must not be taken for a no-op.
+    async def run():
+        dedup, api = EditDeduplicator(), SlowApi()
+        await dedup(api, None, _edit(BASE))
+        api.latency = 0.05
+        flash_on = asyncio.create_task(dedup(api, None, _edit(LIT)))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(flash_on, dedup(api, None, _edit(BASE)))
+        overlapping = list(api.sent)
+        await dedup(api, None, _edit(BASE))  # now known to be on screen
+        return overlapping, api.sent
+
+    overlapping, sent = asyncio.run(run())
+    assert overlapping == [BASE, LIT, BASE]
+    assert sent == [BASE, LIT, BASE]
+
+
+def test_last_edit_sent_is_remembered():
+    # Replies can come back out of order; what is on screen is what was sent last.
+    async def run():
+        dedup, slow = EditDeduplicator(), SlowApi(0.05)
+        fast = SlowApi()
+        first = asyncio.create_task(dedup(slow, None, _edit(LIT)))
+        await asyncio.sleep(0.01)
+        await dedup(fast, None, _edit(BASE))
+        await first
+        await dedup(fast, None, _edit(BASE))
+        return slow.sent + fast.sent
+
+    assert asyncio.run(run()) == [LIT, BASE]
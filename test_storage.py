@@ -0,0 +1,109 @@
+import asyncio
+import sqlite3
+
+from openpyxl import load_workbook
+
+from storage import ExcelResultsRepository, SqliteResultsRepository
+
+PROFILE = {"Telegram ID": 42, "Unique ID": 1234567, "Name": "Ann", "Age": 30}
+
+
+def test_journal_is_replayed_after_a_crash_before_the_save(tmp_path):
+    filename = str(tmp_path / "results.xlsx")
+
+    async def crash():
+        repo = ExcelResultsRepository(filename, flush_interval=3600)
+        await repo.load()
+        await repo.create_profile(42, 1234567, "Ann", 30)
+        await repo.update_results(1234567, {"Corsi - Max Correct Sequence Length": 5}, PROFILE)
+        # The process dies here: both mutations are journaled, the workbook was never saved.
+        await repo._run(repo._journal.close)
+
+    async def restart():
+        repo = ExcelResultsRepository(filename, flush_interval=3600)
+        await repo.load()
+        row = await repo.find_by_uid(1234567)
+        completed = await repo.completed_tests(1234567)
+        await repo.close()
+        return row, completed
+
+    asyncio.run(crash())
+    assert load_workbook(filename).active.max_row == 1
+
+    row, completed = asyncio.run(restart())
+    assert row["Name"] == "Ann"
+    assert row["Corsi - Max Correct Sequence Length"] == 5
+    assert completed == 1
+
+    # load() saved the replayed rows and emptied the journal.
+    sheet = load_workbook(filename).active
+    assert [cell.value for cell in sheet[2]][:4] == [42, 1234567, "Ann", 30]
+    assert (tmp_path / "results.xlsx.journal").read_text() == ""
+
+
+def test_profiles_are_served_from_memory_until_flushed(tmp_path):
+    filename = str(tmp_path / "results.xlsx")
+
+    async def run():
+        repo = ExcelResultsRepository(filename, flush_interval=3600)
+        await repo.load()
+        await repo.create_profile(42, 1234567, "Ann", 30)
+        await repo.create_profile(42, 7654321, "Ann", 31)
+        before_flush = (await repo.find_by_uid(7654321), await repo.find_uids_by_telegram_id(42),
+                        load_workbook(filename).active.max_row)
+        await repo.close()
+        return before_flush
+
+    row, uids, saved_rows = asyncio.run(run())
+    assert row["Age"] == 31
+    assert uids == [1234567, 7654321]
+    assert saved_rows == 1  # only the headers: nothing was saved yet
+    assert load_workbook(filename).active.max_row == 3  # close() flushed both rows
+
+
+def _sqlite_repository(tmp_path) -> SqliteResultsRepository:
+    return SqliteResultsRepository(str(tmp_path / "results.sqlite3"), import_from_excel=None)
+
+
+def test_queued_updates_for_one_uid_are_merged(tmp_path):
+    async def run():
+        repo = _sqlite_repository(tmp_path)
+        await repo.load()
+        await repo.create_profile(42, 1234567, "Ann", 30)
+        batches = []
+        apply_writes = repo._apply_writes
+        repo._apply_writes = lambda batch: batches.append(len(batch)) or apply_writes(batch)
+        await asyncio.gather(
+            repo.update_results(1234567, {"Stroop Part1 Time (s)": 10.0, "Stroop Part1 Errors": 1}, PROFILE),
+            repo.update_results(1234567, {"Stroop Part1 Errors": 2}, PROFILE),
+            repo.update_results(1234567, {"Stroop Part2 Time (s)": 12.5}, PROFILE),
+        )
+        row = await repo.find_by_uid(1234567)
+        await repo.close()
+        return batches, row
+
+    batches, row = asyncio.run(run())
+    assert batches == [1]
+    assert row["Stroop Part1 Time (s)"] == 10.0
+    assert row["Stroop Part1 Errors"] == 2  # later values win
+    assert row["Stroop Part2 Time (s)"] == 12.5
+
+
+def test_duplicate_create_fails_alone(tmp_path):
+    async def run():
+        repo = _sqlite_repository(tmp_path)
+        await repo.load()
+        await repo.create_profile(42, 1234567, "Ann", 30)
+        results = await asyncio.gather(
+            repo.create_profile(43, 1234567, "Bob", 31),
+            repo.create_profile(44, 7654321, "Cid", 32),
+            return_exceptions=True,
+        )
+        rows = await repo.dump_all()
+        await repo.close()
+        return results, rows
+
+    results, rows = asyncio.run(run())
+    assert isinstance(results[0], sqlite3.IntegrityError)
+    assert results[1] is None
+    assert [(row["Unique ID"], row["Name"]) for row in rows] == [(1234567, "Ann"), (7654321, "Cid")]
@@ -0,0 +1,44 @@
+import random
+from collections import Counter
+
+from stroop import STROOP_COLORS, generate_stroop_deck, stroop_ink, stroop_word
+
+SEEDS = range(3000)
+
+
+def _inks(deck: list) -> list:
+    return [stroop_ink(code) for code in deck]
+
+
+def test_every_colour_is_the_answer_equally_often():
+    for seed in SEEDS:
+        for part in (1, 2, 3):
+            counts = Counter(_inks(generate_stroop_deck(part, 10, random.Random(seed))))
+            assert sorted(counts.values()) == [2] * len(STROOP_COLORS)
+
+
+def test_uneven_trial_counts_stay_balanced():
+    for trials in (1, 3, 7, 11, 23):
+        counts = Counter(_inks(generate_stroop_deck(2, trials, random.Random(trials))))
+        assert sum(counts.values()) == trials
+        assert max(counts.values()) - min(counts.get(ink, 0) for ink in range(len(STROOP_COLORS))) <= 1
+
+
+def test_no_ink_twice_in_a_row():
+    # Seeds 3 and 5 used to end in [.., 3, 3] and [.., 4, 4].
+    for seed in SEEDS:
+        for part, trials in ((1, 10), (3, 10), (2, 37)):
+            inks = _inks(generate_stroop_deck(part, trials, random.Random(seed)))
+            assert all(a != b for a, b in zip(inks, inks[1:])), (seed, inks)
+
+
+def test_part3_is_half_incongruent():
+    for seed in SEEDS:
+        deck = generate_stroop_deck(3, 10, random.Random(seed))
+        assert sum(stroop_word(code) != stroop_ink(code) for code in deck) == 5
+
+
+def test_parts_1_and_2_are_congruent():
+    for part in (1, 2):
+        deck = generate_stroop_deck(part, 10, random.Random(1))
+        assert all(stroop_word(code) == stroop_ink(code) for code in deck)
@@ -0,0 +1,49 @@
+import asyncio
+
+from uid_allocator import UidAllocator
+
+
+class FakeRepository:
+    def __init__(self, uids):
+        self.uids = uids
+
+    async def stream_rows(self, consumer):
+        return consumer({"Unique ID": unique_id} for unique_id in self.uids)
+
+
+def _drain(allocator: UidAllocator) -> list:
+    uids = []
+    while (unique_id := allocator.allocate()) is not None:
+        uids.append(unique_id)
+    return uids
+
+
+def test_every_uid_in_the_range_is_handed_out_once():
+    uids = _drain(UidAllocator("key", min_uid=100, max_uid=1099))
+    assert sorted(uids) == list(range(100, 1100))
+    assert uids != sorted(uids)
+
+
+def test_shards_walk_disjoint_positions():
+    shards = []
+    for offset in range(3):
+        allocator = UidAllocator("key", min_uid=0, max_uid=999)
+        allocator.use_shard(offset, 3)
+        shards.append(set(_drain(allocator)))
+    assert all(not shards[i] & shards[j] for i in range(3) for j in range(i + 1, 3))
+    assert set().union(*shards) == set(range(1000))
+
+
+def test_load_skips_uids_already_in_the_store():
+    async def run():
+        first = UidAllocator("key", min_uid=0, max_uid=999)
+        taken = [first.allocate() for _ in range(10)] + [5, 500]
+        allocator = UidAllocator("key", min_uid=0, max_uid=999)
+        await allocator.load(FakeRepository(taken))
+        return taken, allocator
+
+    taken, allocator = asyncio.run(run())
+    assert allocator._position == 10  # resumes after the ten handed out before the restart
+    uids = _drain(allocator)
+    assert not set(uids) & set(taken)
+    assert len(uids) == 1000 - len(set(taken))
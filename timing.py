@@ -0,0 +1,176 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+STEP_LOG_SAMPLE_EVERY = 50  # timed-step lateness is logged (at DEBUG) for one step in N
+
+# Set inside a measured timed step: receives the HTTP round trip of the API calls the step makes.
+_round_trip_observer = contextvars.ContextVar("round_trip_observer", default=None)
+
+
+def ns_to_ms(ns: int) -> int:
+    return round(ns / 1_000_000)
+
+
+class ReceiptTimestampMiddleware(BaseMiddleware):
+    """Stamps each update with `time.monotonic_ns()` the moment the dispatcher receives it.
+
+    Handlers that take a `received_ns` argument get the stamp, so reaction times are
+    measured from receipt rather than from whenever the handler got to run. Register it
+    before the FSM middleware: the stamp must not include the FSM storage read.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+            event: Any,
+            data: dict[str, Any],
+    ) -> Any:
+        data["received_ns"] = time.monotonic_ns()
+        return await handler(event, data)
+
+
+def corsi_trial_timing(length: int, prompt_sent_ns: int, prompt_shown_ns: int, tap_received_ns: list,
+                       tap_queue_ms: list, wall_clock_time: float, prompt_telegram_date: int | None = None) -> dict:
+    """Compact per-trial record kept in the FSM `sequence_times` list.
+
+    `time` (seconds) runs from the moment Telegram confirmed the prompt edit to the
+    receipt of the last tap; `taps` are the receipt offsets (ms) of every tap from that
+    same moment. The handler queue delay per tap, the prompt round trip and the
+    wall-clock time the old timer would have reported are kept for the latency report.
+    """
+    taps = [ns_to_ms(t - prompt_shown_ns) for t in tap_received_ns]
+    trial = {
+        'len': length,
+        'time': taps[-1] / 1000 if taps else wall_clock_time,
+        'taps': taps,
+        'rtt': ns_to_ms(prompt_shown_ns - prompt_sent_ns),
+        'queue': max(tap_queue_ms, default=0),
+        'wall': round(wall_clock_time, 3),
+    }
+    if prompt_telegram_date:
+        trial['tg'] = prompt_telegram_date
+    return trial
+
+
+def corsi_tap_times_detail(sequence_times: list) -> str:
+    return "; ".join(f"L{item['len']}:[{','.join(map(str, item['taps']))}]"
+                     for item in sequence_times if item.get('taps'))
+
+
+def corsi_latency_report(sequence_times: list) -> str:
+    """How much server-side latency the per-tap timestamps took out of the score."""
+    measured = [item for item in sequence_times if 'taps' in item]
+    if not measured:
+        return ""
+    avg_rtt = sum(item['rtt'] for item in measured) / len(measured)
+    max_queue = max(item['queue'] for item in measured)
+    avg_overhead = sum(item['wall'] - item['time'] for item in measured) / len(measured)
+    return (f"prompt RTT avg {avg_rtt:.0f} ms; handler queue max {max_queue} ms; "
+            f"removed from score avg {avg_overhead:.3f} s over {len(measured)} trials")
+
+
+class RoundTripMiddleware(BaseRequestMiddleware):
+    """Bot session middleware (register it innermost): reports the HTTP round trip of the
+    API calls timed steps make to their TimingScheduler.
+
+    Waiting for rate-limit tokens happens in the outer OutboundScheduler, so one
+    throttled chat never shifts the lead of everyone else's steps.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        observe = _round_trip_observer.get()
+        if observe is None:
+            return await make_request(bot, method)
+        started = time.monotonic()
+        result = await make_request(bot, method)
+        observe(time.monotonic() - started)
+        return result
+
+
+class TimingScheduler:
+    """Runs timed UI steps (stimulus edits) against absolute monotonic deadlines.
+
+    All plans share the event loop's timer heap: a pending step costs one timer handle,
+    not a sleeping coroutine, and a running step is a short task that makes one API call.
+    Steps are issued early by the estimated one-way API latency (half the smoothed
+    round trip of their API calls, as RoundTripMiddleware measures it, capped at
+    `max_latency`), so the edit lands on Telegram's side at the deadline rather than a
+    round trip later, and lateness never accumulates from step to step.
+    """
+
+    def __init__(self, smoothing: float = 0.2, max_latency: float = 0.5):
+        self.smoothing = smoothing
+        self.max_latency = max_latency
+        self.latency = 0.0  # smoothed API round trip, seconds
+
+    @property
+    def lead(self) -> float:
+        return self.latency / 2
+
+    def observe(self, round_trip: float):
+        round_trip = min(round_trip, self.max_latency)
+        self.latency = round_trip if not self.latency else (
+                self.smoothing * round_trip + (1 - self.smoothing) * self.latency)
+
+    def plan(self, name: str) -> "TimedPlan":
+        return TimedPlan(self, name)
+
+
+class TimedPlan:
+    """One timed sequence: steps due at offsets from the moment the plan was created.
+
+    `cancel()` drops every step that has not started yet and cancels the ones in
+    flight, so no stale edit reaches the chat. A step that raises cancels the rest.
+    """
+
+    def __init__(self, scheduler: TimingScheduler, name: str):
+        self.scheduler = scheduler
+        self.name = name
+        self.loop = asyncio.get_running_loop()
+        self.start = self.loop.time()
+        self.cancelled = False
+        self._handles = []
+        self._tasks = set()
+
+    def at(self, offset: float, step: Callable[[], Awaitable[Any]], compensate: bool = True):
+        """Schedules `step()` to take effect `offset` seconds after the plan start."""
+        deadline = self.start + offset - (self.scheduler.lead if compensate else 0)
+        self._handles.append(self.loop.call_at(deadline, self._fire, step, compensate, deadline))
+
+    def _fire(self, step, measure: bool, deadline: float):
+        if self.cancelled:
+            return
+        task = self.loop.create_task(self._run_step(step, measure, deadline))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_step(self, step, measure: bool, deadline: float):
+        if measure:
+            _round_trip_observer.set(self.scheduler.observe)  # this task's context only
+        # Every flash and stimulus is a step, so only a sample of them is logged.
+        logger.debug("Timed step of %s started %.1f ms after its deadline", self.name,
+                     (self.loop.time() - deadline) * 1000, extra={"sample_every": STEP_LOG_SAMPLE_EVERY})
+        try:
+            await step()
+        except Exception as e:
+            logger.error("Timed step of %s failed, cancelling the rest of the plan: %s", self.name, e)
+            self.cancel()
+
+    def cancel(self):
+        self.cancelled = True
+        for handle in self._handles:
+            handle.cancel()
+        self._handles.clear()
+        current = asyncio.current_task()
+        for task in list(self._tasks):
+            if task is not current:
+                task.cancel()
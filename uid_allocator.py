@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import logging
+
+from storage import ResultsRepository
+
+logger = logging.getLogger(__name__)
+
+MIN_UID, MAX_UID = 1000000, 9999999  # 7-digit UIDs
+
+
+class UidAllocator:
+    """Hands out unused 7-digit UIDs in O(1) without guessing.
+
+    The n-th UID is MIN_UID + P(n), where P is a keyed Feistel permutation of the
+    9,000,000 offsets (cycle-walking on a 24-bit network), so consecutive
+    registrations get unrelated-looking numbers but never the same one twice. Bot
+    worker processes walk disjoint positions (offset, offset + stride, ...), so they
+    cannot collide with each other either. UIDs already present in the results store
+    (including the randomly generated ones from before) are kept in a bitmap and
+    skipped; the bitmap takes about 1.1 MB for the whole range. `load()` also moves the
+    position past the UIDs handed out before a restart, so that walk happens once, at
+    startup, and off the event loop. Unsharded instances sharing one store (webhook
+    replicas) walk the same positions: call `load()` again when a UID turns out to be
+    taken, to pick up everything the others registered since.
+    """
+
+    def __init__(self, key: str, min_uid: int = MIN_UID, max_uid: int = MAX_UID, rounds: int = 4):
+        self.min_uid = min_uid
+        self.size = max_uid - min_uid + 1
+        self.rounds = rounds
+        self._key = hashlib.blake2b(key.encode("utf-8"), digest_size=32).digest()
+        self._half_bits = ((self.size - 1).bit_length() + 1) // 2
+        self._half_mask = (1 << self._half_bits) - 1
+        self._used = bytearray((self.size + 7) // 8)
+        self._used_count = 0
+        self.offset = 0
+        self.stride = 1
+        self._position = 0
+
+    def use_shard(self, offset: int, stride: int):
+        """Restricts this allocator to positions offset, offset + stride, ... (one per worker)."""
+        self.offset, self.stride = offset, stride
+        self._position = offset
+
+    async def load(self, repository: ResultsRepository):
+        uids = await repository.stream_rows(lambda rows: [row.get("Unique ID") for row in rows])
+        for unique_id in uids:
+            if isinstance(unique_id, int):
+                self.mark_used(unique_id)
+        # allocate() may run while the walk is in the thread; never move the position back.
+        self._position = max(self._position, await asyncio.to_thread(self._first_unused_position))
+        logger.info("UID allocator loaded %s used UIDs; resuming at position %s.", self._used_count, self._position)
+
+    def _first_unused_position(self) -> int:
+        position = self._position
+        while position < self.size and self.is_used(self.min_uid + self.permute(position)):
+            position += self.stride
+        return position
+
+    def _round(self, round_index: int, half: int) -> int:
+        digest = hashlib.blake2b(bytes([round_index]) + half.to_bytes(4, "big"), digest_size=4, key=self._key).digest()
+        return int.from_bytes(digest, "big") & self._half_mask
+
+    def permute(self, position: int) -> int:
+        value = position
+        while True:  # cycle-walk until the Feistel output falls back into [0, size)
+            left, right = value >> self._half_bits, value & self._half_mask
+            for round_index in range(self.rounds):
+                left, right = right, left ^ self._round(round_index, right)
+            value = (left << self._half_bits) | right
+            if value < self.size:
+                return value
+
+    def is_used(self, unique_id: int) -> bool:
+        offset = unique_id - self.min_uid
+        if not 0 <= offset < self.size:
+            return False
+        return bool(self._used[offset >> 3] & (1 << (offset & 7)))
+
+    def mark_used(self, unique_id: int):
+        offset = unique_id - self.min_uid
+        if not 0 <= offset < self.size or self.is_used(unique_id):
+            return
+        self._used[offset >> 3] |= 1 << (offset & 7)
+        self._used_count += 1
+
+    def allocate(self) -> int | None:
+        """Next unused UID, or None when this allocator's share of the range is exhausted."""
+        while self._position < self.size and self._used_count < self.size:
+            unique_id = self.min_uid + self.permute(self._position)
+            self._position += self.stride
+            if not self.is_used(unique_id):
+                self.mark_used(unique_id)
+                return unique_id
+        return None
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from collections.abc import Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/webhook"
+HEALTH_PATH = "/healthz"
+
+
+async def _health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+def build_webhook_app(dispatcher: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH,
+                      secret: str | None = None) -> web.Application:
+    """aiohttp app that feeds Telegram webhook POSTs on `path` to the dispatcher.
+
+    Requests without the matching X-Telegram-Bot-Api-Secret-Token header are rejected
+    when `secret` is set. Updates are handled in the background, so Telegram (or the
+    reverse proxy in front of us) gets its 200 as soon as the body is parsed.
+    """
+    app = web.Application()
+    app.router.add_get(HEALTH_PATH, _health)
+    SimpleRequestHandler(dispatcher=dispatcher, bot=bot, secret_token=secret).register(app, path=path)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+def build_forwarding_app(forward: Callable[[dict], None], path: str = WEBHOOK_PATH,
+                         secret: str | None = None) -> web.Application:
+    """aiohttp app that hands each raw webhook update to `forward` instead of a dispatcher."""
+
+    async def receive_update(request: web.Request) -> web.Response:
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=401)
+        forward(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get(HEALTH_PATH, _health)
+    app.router.add_post(path, receive_update)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, host: str = "0.0.0.0", port: int = 8080,
+                      path: str = WEBHOOK_PATH, secret: str | None = None, base_url: str | None = None):
+    await serve_app(build_webhook_app(dispatcher, bot, path=path, secret=secret), bot, host=host, port=port,
+                    path=path, secret=secret, base_url=base_url,
+                    allowed_updates=dispatcher.resolve_used_update_types())
+
+
+async def serve_app(app: web.Application, bot: Bot, host: str = "0.0.0.0", port: int = 8080,
+                    path: str = WEBHOOK_PATH, secret: str | None = None, base_url: str | None = None,
+                    allowed_updates: list | None = None):
+    """Serves a webhook app until cancelled.
+
+    With `base_url` (the public https address the reverse proxy forwards from) the
+    webhook is registered with Telegram on startup; without it registration is left to
+    the deployment, which is what local load tests with a fake sender want.
+    """
+    if base_url:
+        async def register_webhook(*_):
+            url = base_url.rstrip("/") + path
+            await bot.set_webhook(url, secret_token=secret, drop_pending_updates=True,
+                                  allowed_updates=allowed_updates)
+            logger.info("Webhook registered at %s", url)
+
+        app.on_startup.append(register_webhook)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Webhook server listening on %s:%s%s (health: %s)", host, port, path, HEALTH_PATH)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
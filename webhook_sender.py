@@ -0,0 +1,101 @@
+"""Fake Telegram sender for load-testing the webhook locally.
+
+Posts synthetic updates (a /start message followed by a /mydata message per fake user)
+to a running webhook and prints acceptance latency as JSON:
+
+    python webhook_sender.py --url http://127.0.0.1:8080/webhook --secret s3cret --users 200
+
+The bot still answers through the Bot API, so point it at a fake API server (or expect
+its outbound calls to fail) when running this against a test token.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import aiohttp
+
+_update_ids = itertools.count(1)
+
+
+def fake_message_update(user_id: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    user = {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith("/") else [],
+        },
+    }
+
+
+async def _post(session: aiohttp.ClientSession, url: str, headers: dict, update: dict, latencies: list,
+                failures: list):
+    started = time.perf_counter()
+    try:
+        async with session.post(url, json=update, headers=headers) as response:
+            await response.read()
+            if response.status != 200:
+                failures.append(response.status)
+                return
+    except aiohttp.ClientError as e:
+        failures.append(type(e).__name__)
+        return
+    latencies.append(time.perf_counter() - started)
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run(url: str, secret: str | None, users: int, concurrency: int, first_user_id: int) -> dict:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    latencies, failures = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession() as session:
+        async def user_session(user_id: int):
+            for text in ("/start", "/mydata"):
+                async with semaphore:
+                    await _post(session, url, headers, fake_message_update(user_id, text), latencies, failures)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_session(first_user_id + i) for i in range(users)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "updates_sent": len(latencies) + len(failures),
+        "failures": len(failures),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round((len(latencies) + len(failures)) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.5) * 1000, 2),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send fake Telegram updates to the bot's webhook.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--first-user-id", type=int, default=10_000_000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.url, args.secret, args.users, args.concurrency, args.first_user_id)),
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import asyncio
+import importlib
+import logging
+import multiprocessing
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+
+from webhook import WEBHOOK_PATH, build_forwarding_app, serve_app
+
+logger = logging.getLogger(__name__)
+
+EXPORT_WORKER = 0  # the only worker that builds /export snapshots
+
+
+def update_chat_id(raw_update: dict) -> int | None:
+    """Chat (or, failing that, user) the raw update belongs to."""
+    for key, event in raw_update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        for candidate in (event.get("chat"), (event.get("message") or {}).get("chat"), event.get("from"),
+                          event.get("user")):
+            if candidate and "id" in candidate:
+                return candidate["id"]
+    return None
+
+
+def is_export_command(raw_update: dict) -> bool:
+    text = (raw_update.get("message") or {}).get("text") or ""
+    return text.split(maxsplit=1)[0].split("@")[0] == "/export" if text else False
+
+
+def shard_for(raw_update: dict, worker_count: int) -> int:
+    if is_export_command(raw_update):
+        return EXPORT_WORKER
+    chat_id = update_chat_id(raw_update)
+    return hash(chat_id) % worker_count if chat_id is not None else 0
+
+
+class ShardRouter:
+    """Front process: receives updates and sends each to the worker that owns its chat.
+
+    Every chat always lands on the same worker, so its FSM snapshot, cancel flags and
+    running Corsi loop stay in one process. /export always goes to EXPORT_WORKER so a
+    single process writes the export directory.
+    """
+
+    def __init__(self, app_module: str, worker_count: int):
+        self.app_module = app_module
+        self.worker_count = worker_count
+        context = multiprocessing.get_context("spawn")
+        self.queues = [context.Queue() for _ in range(worker_count)]
+        self.processes = [
+            context.Process(target=_worker_main, args=(app_module, index, worker_count, queue),
+                            name=f"bot-worker-{index}", daemon=True)
+            for index, queue in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        logger.info("Started %s bot worker processes.", self.worker_count)
+
+    def route(self, raw_update: dict):
+        self.queues[shard_for(raw_update, self.worker_count)].put(raw_update)
+
+    def stop(self, timeout: float = 30):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("%s did not stop in %ss; terminating.", process.name, timeout)
+                process.terminate()
+
+    async def poll(self, bot: Bot, allowed_updates: list | None = None):
+        await bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.error("Error fetching updates: %s", e)
+                await asyncio.sleep(5)
+                continue
+            for update in updates:
+                self.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+
+    async def serve_webhook(self, bot: Bot, host: str = "0.0.0.0", port: int = 8080, path: str = WEBHOOK_PATH,
+                            secret: str | None = None, base_url: str | None = None,
+                            allowed_updates: list | None = None):
+        await serve_app(build_forwarding_app(self.route, path=path, secret=secret), bot, host=host, port=port,
+                        path=path, secret=secret, base_url=base_url, allowed_updates=allowed_updates)
+
+
+def _worker_main(app_module: str, index: int, worker_count: int, queue):
+    # "__main__" resolves to the bot script re-run by the spawn start method.
+    app = importlib.import_module(app_module)
+    try:
+        asyncio.run(_worker_loop(app, index, worker_count, queue))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _feed(app, raw_update: dict):
+    try:
+        await app.dp.feed_raw_update(app.bot, raw_update)
+    except Exception:
+        # feed_raw_update only logs that the update was not handled; the handler's error comes here.
+        logger.exception("Update %s failed in shard worker", raw_update.get("update_id"))
+
+
+async def _worker_loop(app, index: int, worker_count: int, queue):
+    app.setup_worker(index, worker_count)
+    await app.dp.emit_startup(bot=app.bot)
+    loop = asyncio.get_running_loop()
+    pending = set()
+    logger.info("Bot worker %s/%s ready.", index, worker_count)
+    try:
+        while True:
+            raw_update = await loop.run_in_executor(None, queue.get)
+            if raw_update is None:
+                break
+            task = asyncio.create_task(_feed(app, raw_update))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    finally:
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        await app.dp.emit_shutdown(bot=app.bot)
+        await app.dp.storage.close()
+        await app.bot.session.close()
+        logger.info("Bot worker %s stopped.", index)